@@ -0,0 +1,210 @@
+"""KPI and chart panel aggregations computed from the filtered sales frame"""
+from bisect import bisect_left
+from dataclasses import dataclass, field
+import calendar
+
+import numpy as np
+import pandas as pd
+
+from perf import instrumented
+
+
+MONTH_NAMES = list(calendar.month_name)[1:]
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+RECENT_ORDER_COLUMNS = ['Order ID', 'Product', 'Quantity Ordered', 'Price Each', 'Total Sale', 'Order Date', 'City']
+
+
+@dataclass
+class PanelResults:
+    """Aggregated rows backing the KPI row and every chart panel
+
+    errors maps the name of a panel that failed or timed out to its
+    exception; that panel's field is None. margins holds the 95% confidence
+    half-widths of the KPIs when the panels are estimated from a sample.
+    """
+    row_count: int
+    total_revenue: float
+    total_orders: int
+    total_units: int
+    products: pd.DataFrame
+    cities: pd.DataFrame
+    hourly: pd.DataFrame
+    days: pd.DataFrame
+    aov: pd.DataFrame
+    errors: dict = field(default_factory=dict)
+    margins: dict = field(default_factory=dict)
+
+    @property
+    def avg_order_value(self):
+        return self.total_revenue / self.total_orders if self.total_orders > 0 else 0
+
+    @property
+    def approximate(self):
+        return bool(self.margins)
+
+    @property
+    def empty(self):
+        return self.row_count == 0
+
+    @property
+    def details(self):
+        """The day of week and average order value panels, computed in the same pass"""
+        return DetailPanels(self.days, self.aov, {name: e for name, e in self.errors.items() if name in ('days', 'aov')})
+
+
+@dataclass
+class DetailPanels:
+    """Day of week and average order value panels of the below-the-fold details section"""
+    days: pd.DataFrame
+    aov: pd.DataFrame
+    errors: dict = field(default_factory=dict)
+
+
+@instrumented('filter_options')
+def filter_options(sales_data):
+    """Date bounds, products and cities used to populate the sidebar"""
+    return {
+        'min_date': sales_data['Order Date'].min(),
+        'max_date': sales_data['Order Date'].max(),
+        'products': sorted(sales_data['Product'].dropna().unique()),
+        'cities': sorted(sales_data['City'].dropna().unique()),
+    }
+
+
+def merge_filter_options(options, new_options):
+    """Combine the filter options of a snapshot with those of newly appended rows"""
+    return {
+        'min_date': min(options['min_date'], new_options['min_date']),
+        'max_date': max(options['max_date'], new_options['max_date']),
+        'products': sorted(set(options['products']) | set(new_options['products'])),
+        'cities': sorted(set(options['cities']) | set(new_options['cities'])),
+    }
+
+
+def _present(labels, counts, values, columns):
+    """Frame of the labels that occur at least once, with their summed values"""
+    present = np.flatnonzero(counts)
+    return pd.DataFrame({columns[0]: np.asarray(labels, dtype=object)[present], columns[1]: values[present]})
+
+
+def distinct_orders(order_ids, product):
+    """Distinct non-null orders overall and per product category"""
+    order_codes, uniques = pd.factorize(np.asarray(order_ids))
+    valid = order_codes >= 0
+    n_orders = max(len(uniques), 1)
+
+    # Unique (product, order) pairs, hashed as one int64 key
+    product_codes = product.codes[valid].astype(np.int64)
+    pairs = pd.unique(product_codes * n_orders + order_codes[valid])
+    pair_products = pairs // n_orders
+    per_product = np.bincount(pair_products[pair_products >= 0], minlength=len(product.categories))
+    return len(uniques), per_product
+
+
+def _dated(key, *values):
+    """key and values without the rows whose key is -1, those without an Order Date"""
+    dated = key >= 0
+    if dated.all():
+        return (key, *values)
+    return (key[dated], *(value[dated] for value in values))
+
+
+def aggregate_panels(product, city, hour, weekday, revenue, units, rows, lines, total_orders, product_orders):
+    """Compute every KPI and panel breakdown with one bincount reduction per key
+
+    Keys are already factorized: product and city are Categoricals (code -1
+    when missing), hour is 0-23 and weekday 0-6 starting on Monday, both -1
+    for rows without an Order Date, which only count towards the totals.
+    rows and lines weight each input row, so the same engine serves raw rows
+    (weights of one) and cube cells (their counts). product_orders holds the
+    distinct orders per product category.
+    """
+    revenue = np.nan_to_num(np.asarray(revenue, dtype='float64'))
+    units = np.nan_to_num(np.asarray(units, dtype='float64'))
+    rows = np.asarray(rows, dtype='float64')
+    lines = np.asarray(lines)
+
+    # Shift codes by one so missing products and cities land in bin 0
+    product_codes = product.codes.astype(np.intp) + 1
+    city_codes = city.codes.astype(np.intp) + 1
+    n_products = len(product.categories) + 1
+    n_cities = len(city.categories) + 1
+
+    product_rows = np.bincount(product_codes, rows, n_products)[1:]
+    product_revenue = np.bincount(product_codes, revenue, n_products)[1:]
+    city_rows = np.bincount(city_codes, rows, n_cities)[1:]
+    city_revenue = np.bincount(city_codes, revenue, n_cities)[1:]
+    hour, hour_weights, hour_line_weights = _dated(np.asarray(hour), rows, lines)
+    hour_rows = np.bincount(hour, hour_weights, 24)
+    hour_lines = np.bincount(hour, hour_line_weights, 24).astype('int64')
+    weekday, weekday_weights, weekday_revenue_weights = _dated(np.asarray(weekday), rows, revenue)
+    weekday_rows = np.bincount(weekday, weekday_weights, 7)
+    weekday_revenue = np.bincount(weekday, weekday_revenue_weights, 7)
+
+    product_sales = _present(product.categories, product_rows, product_revenue, ['Product', 'Total Sale'])
+    top_products = product_sales.sort_values('Total Sale', ascending=False).head(10)
+
+    city_sales = _present(city.categories, city_rows, city_revenue, ['City', 'Total Sale'])
+    city_sales = city_sales.sort_values('Total Sale', ascending=False)
+
+    hourly_orders = _present(np.arange(24), hour_rows, hour_lines, ['Hour', 'Order ID'])
+    hourly_orders['Hour'] = hourly_orders['Hour'].astype('int64')
+
+    day_sales = _present(DAY_NAMES, weekday_rows, weekday_revenue, ['Day', 'Total Sale'])
+
+    # Average order value by product
+    product_aov = product_sales.rename(columns={'Total Sale': 'Revenue'})
+    product_aov.insert(1, 'Orders', np.asarray(product_orders)[np.flatnonzero(product_rows)])
+    product_aov['AOV'] = product_aov['Revenue'] / product_aov['Orders']
+    product_aov = product_aov.sort_values('AOV', ascending=False).head(10)
+
+    return PanelResults(
+        row_count=int(rows.sum()),
+        total_revenue=float(revenue.sum()),
+        total_orders=int(total_orders),
+        total_units=int(units.sum()),
+        products=top_products,
+        cities=city_sales,
+        hourly=hourly_orders,
+        days=day_sales,
+        aov=product_aov,
+    )
+
+
+@instrumented('panels[in-memory]')
+def compute_panels(filtered_data):
+    """Compute every panel from an already filtered snapshot in a single pass"""
+    product = filtered_data['Product'].array
+    total_orders, product_orders = distinct_orders(filtered_data['Order ID'], product)
+    return aggregate_panels(
+        product=product,
+        city=filtered_data['City'].array,
+        hour=filtered_data['Hour'].to_numpy(),
+        weekday=filtered_data['Day'].cat.codes.to_numpy(),
+        revenue=filtered_data['Total Sale'].to_numpy(),
+        units=filtered_data['Quantity Ordered'].to_numpy(),
+        rows=np.ones(len(filtered_data)),
+        lines=filtered_data['Order ID'].notna().to_numpy(),
+        total_orders=total_orders,
+        product_orders=product_orders,
+    )
+
+
+@instrumented('recent_orders[in-memory]', rows_in=lambda args, result: args[1])
+def recent_orders(sales_data, rows, limit=10, before=None):
+    """Return a page of the latest orders among the selected rows of the date-sorted snapshot
+
+    rows is the slice or ascending positions from FilterIndex.rows, so the
+    latest orders are its last positions and no sort is needed. Pages are
+    keyset-paginated on the snapshot position: pass the cursor returned with
+    one page as before to fetch the next, older page. Returns (orders, cursor);
+    the cursor is None once history is exhausted.
+    """
+    if isinstance(rows, slice):
+        rows = range(*rows.indices(len(sales_data)))
+    end = len(rows) if before is None else bisect_left(rows, before)
+    start = max(end - limit, 0)
+
+    page = np.asarray(rows[start:end])[::-1]
+    cursor = int(page[-1]) if start > 0 else None
+    return sales_data.iloc[page][RECENT_ORDER_COLUMNS], cursor
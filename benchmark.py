@@ -0,0 +1,292 @@
+"""Benchmark the dashboard pipeline stage by stage on synthetic sales data
+
+    python benchmark.py --rows 100k 1M 10M
+    python benchmark.py --rows 1M --db-url postgresql://localhost/bench --replace
+    python benchmark.py --rows 1M --json after.json --baseline before.json
+    python benchmark.py --rows 1M --coverage 20
+
+Without --db-url the rows are written to a temporary SQLite file, which covers
+the in-memory stages; the cursor and COPY load paths and the SQL pushdown
+stages need PostgreSQL. The "data_ETL" table of the target database is
+replaced, so point --db-url at a scratch database. --coverage also checks how
+often the approximate mode's 95% margins contain the exact KPIs.
+"""
+import argparse
+from dataclasses import asdict, dataclass
+import gc
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import inspect
+
+from aggregations import compute_panels, filter_options, recent_orders
+from charts import (
+    city_sales_figure, day_sales_figure, hourly_orders_figure, product_aov_figure, sales_trend_figure,
+    top_products_figure,
+)
+from cube import build_cube, cube_panels, cube_trend
+from db import DBSettings, create_sales_engine
+from export import CHUNK_ROWS, snapshot_chunks, write_export
+from filters import FilterIndex, filter_frame, make_filter_state
+from parquet_cache import ParquetSnapshotCache
+from queries import (
+    query_detail_panels, query_export_chunks, query_panels, query_raw_rows, query_recent_orders, query_trend,
+)
+from sampling import StratifiedSample, estimate_panels, interval_coverage
+from snapshot import build_snapshot
+from synthetic import generate_sales_rows
+from trends import GRANULARITIES, TrendIndex, trend_frame
+
+
+TABLE_NAME = 'data_ETL'
+# Figure name -> (builder, PanelResults field it draws)
+FIGURES = {
+    'top_products': (top_products_figure, 'products'),
+    'city_sales': (city_sales_figure, 'cities'),
+    'hourly_orders': (hourly_orders_figure, 'hourly'),
+    'day_sales': (day_sales_figure, 'days'),
+    'product_aov': (product_aov_figure, 'aov'),
+}
+ROW_SUFFIXES = {'k': 1_000, 'M': 1_000_000}
+# Stages faster than this are too noisy to flag as regressions
+MIN_COMPARE_SECONDS = 0.005
+# Coverage of the approximate mode's 95% margins below this is flagged
+MIN_COVERAGE = 0.9
+
+
+@dataclass
+class StageResult:
+    """Best wall time and peak traced allocation of one pipeline stage"""
+    rows: int
+    stage: str
+    seconds: float
+    peak_mb: float = None
+
+
+def parse_rows(value):
+    """Row count from 100000, 100k or 1M"""
+    if value[-1:] in ROW_SUFFIXES:
+        return int(float(value[:-1]) * ROW_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def measure(fn, repeat=1, trace_memory=True):
+    """Return fn()'s result, its best wall time over repeat runs and the peak traced bytes of one more run
+
+    Memory is traced in a run of its own because tracemalloc slows allocations
+    down. It sees Python and NumPy allocations but not Arrow's memory pool.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+
+    peak = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, best, peak
+
+
+def seed_database(engine, n_rows, seed=0):
+    """Replace "data_ETL" with n_rows synthetic rows"""
+    chunks = generate_sales_rows(n_rows, seed=seed)
+    first = next(chunks, None)
+    if first is None:
+        return
+    first.head(0).to_sql(TABLE_NAME, engine, if_exists='replace', index=False)
+
+    if engine.dialect.name != 'postgresql':
+        for chunk in (first, *chunks):
+            chunk.to_sql(TABLE_NAME, engine, if_exists='append', index=False, chunksize=50_000)
+        return
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            for chunk in (first, *chunks):
+                buffer = io.StringIO()
+                chunk.to_csv(buffer, index=False, header=False)
+                buffer.seek(0)
+                cursor.copy_expert(f'COPY "{TABLE_NAME}" FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(f'ANALYZE "{TABLE_NAME}"')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def check_coverage(snapshot, options, seeds):
+    """Coverage of the sample margins for the default selection and a narrow one; returns the low ones"""
+    last_month = options['max_date'].to_period('M').start_time
+    selections = {
+        'default': make_filter_state(options['min_date'], options['max_date'],
+                                     tuple(options['products'][:5]), tuple(options['cities'][:3])),
+        'narrow': make_filter_state(last_month, options['max_date'],
+                                    tuple(options['products'][:1]), tuple(options['cities'][:1])),
+    }
+    low = []
+    for selection, state in selections.items():
+        for kpi, share in interval_coverage(snapshot, state, seeds).items():
+            print(f"  {f'coverage[{selection}]':<28} {share:>10.2f}   {kpi}", flush=True)
+            if share < MIN_COVERAGE:
+                low.append((selection, kpi, share))
+    return low
+
+
+def benchmark_pipeline(engine, n_rows, repeat=1, trace_memory=True, coverage_seeds=0):
+    """Time every stage the dashboard runs, from the table load to the CSV export
+
+    Returns (stage results, low margin coverages); coverage is only checked
+    with coverage_seeds samples.
+    """
+    results = []
+
+    def stage(name, fn):
+        result, seconds, peak = measure(fn, repeat, trace_memory)
+        results.append(StageResult(n_rows, name, seconds, None if peak is None else peak / 2**20))
+        print(f"  {name:<28} {seconds:>10.4f} s" + ("" if peak is None else f" {peak / 2**20:>10.1f} MB"),
+              flush=True)
+        return result
+
+    postgres = engine.dialect.name == 'postgresql'
+    raw = stage('load[read_sql]', lambda: query_raw_rows(engine, mode='read_sql'))
+    if postgres:
+        stage('load[cursor]', lambda: query_raw_rows(engine, mode='cursor'))
+        # The dashboard's default load path feeds the stages below
+        raw = stage('load[copy]', lambda: query_raw_rows(engine, mode='copy'))
+
+    snapshot = stage('preprocess', lambda: build_snapshot(raw))
+    del raw
+    # A cold start with a local cache reads it instead of loading and preprocessing
+    with tempfile.TemporaryDirectory() as cache_dir:
+        stage('cache_save', lambda: ParquetSnapshotCache(tempfile.mkdtemp(dir=cache_dir)).save(snapshot))
+        cache = ParquetSnapshotCache(cache_dir)
+        cache.save(snapshot)
+        stage('cache_load', cache.load)
+    options = stage('filter_options', lambda: filter_options(snapshot))
+    index = stage('filter_index', lambda: FilterIndex.from_snapshot(snapshot))
+    cube = stage('cube', lambda: build_cube(snapshot))
+    trend_index = stage('trend_index', lambda: TrendIndex.from_snapshot(snapshot))
+    sample = stage('sample', lambda: StratifiedSample.from_snapshot(snapshot))
+
+    # The sidebar's default selection
+    state = make_filter_state(options['min_date'], options['max_date'],
+                              tuple(options['products'][:5]), tuple(options['cities'][:3]))
+    rows = stage('filter[index]', lambda: index.rows(state))
+    stage('filter[mask]', lambda: filter_frame(snapshot, state))
+    filtered = stage('filter[gather]', lambda: snapshot.iloc[rows])
+
+    # Every panel comes out of one aggregation pass
+    panels = stage('panels[in-memory]', lambda: compute_panels(filtered))
+    stage('panels[cube]', lambda: cube_panels(cube, state))
+    stage('panels[sample]', lambda: estimate_panels(sample, state))
+    if postgres:
+        stage('panels[sql]', lambda: query_panels(engine, state))
+        stage('details[sql]', lambda: query_detail_panels(engine, state))
+
+    # Build each figure from scratch, bypassing the figure memo
+    for name, (builder, field) in FIGURES.items():
+        stage(f'figure[{name}]', lambda: builder.__wrapped__(getattr(panels, field)))
+
+    # The trend re-bins hourly sums, so switching granularity skips the rows
+    series = stage('trend[in-memory]', lambda: trend_index.series(snapshot, rows))
+    stage('trend[cube]', lambda: cube_trend(cube, state))
+    if postgres:
+        stage('trend[sql]', lambda: query_trend(engine, state))
+    for granularity in GRANULARITIES:
+        trend = stage(f'trend_frame[{granularity.lower()}]', lambda: trend_frame(series, granularity))
+    stage('figure[sales_trend]', lambda: sales_trend_figure.__wrapped__(trend))
+
+    stage('recent_orders[in-memory]', lambda: recent_orders(snapshot, rows))
+    if postgres:
+        stage('recent_orders[sql]', lambda: query_recent_orders(engine, state))
+
+    stage('export_csv[snapshot]', lambda: write_export(snapshot_chunks(snapshot, rows), 'CSV').close())
+    if postgres:
+        stage('export_csv[sql]', lambda: write_export(query_export_chunks(engine, state, CHUNK_ROWS), 'CSV').close())
+
+    low_coverage = check_coverage(snapshot, options, coverage_seeds) if coverage_seeds else []
+    return results, [(n_rows, *entry) for entry in low_coverage]
+
+
+def regressions(results, baseline, tolerance):
+    """(result, baseline seconds) for every stage more than tolerance times slower than the baseline"""
+    previous = {(entry['rows'], entry['stage']): entry['seconds'] for entry in baseline}
+    slower = []
+    for result in results:
+        before = previous.get((result.rows, result.stage))
+        if before is not None and result.seconds > max(before, MIN_COMPARE_SECONDS) * tolerance:
+            slower.append((result, before))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sales dashboard pipeline on synthetic data")
+    parser.add_argument('--rows', nargs='+', type=parse_rows, default=[100_000],
+                        help="row counts to benchmark, e.g. 100k 1M 10M")
+    parser.add_argument('--db-url', help="scratch PostgreSQL database; a temporary SQLite file by default")
+    parser.add_argument('--replace', action='store_true', help="allow replacing an existing data_ETL table")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage; the best is reported")
+    parser.add_argument('--no-memory', action='store_true', help="skip the traced run measuring peak memory")
+    parser.add_argument('--seed', type=int, default=0, help="random seed of the generated rows")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=1.25,
+                        help="flag stages slower than this multiple of the baseline")
+    parser.add_argument('--coverage', type=int, default=0, metavar='SEEDS',
+                        help="check the approximate mode's 95%% margins over this many sample seeds")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        url = args.db_url or f"sqlite:///{os.path.join(scratch, 'bench.db')}"
+        # Bulk stages at 10M rows outlast the dashboard's statement timeout
+        engine = create_sales_engine(DBSettings(url=url, statement_timeout_ms=0))
+        if args.db_url and inspect(engine).has_table(TABLE_NAME) and not args.replace:
+            parser.error(f'{TABLE_NAME} already exists in {engine.url!r}; pass --replace to overwrite it')
+
+        results, low_coverage = [], []
+        for n_rows in args.rows:
+            print(f"{n_rows:,} rows on {engine.dialect.name}", flush=True)
+            started = time.perf_counter()
+            seed_database(engine, n_rows, args.seed)
+            print(f"  {'(seed database)':<28} {time.perf_counter() - started:>10.4f} s", flush=True)
+            stages, low = benchmark_pipeline(engine, n_rows, args.repeat, not args.no_memory, args.coverage)
+            results += stages
+            low_coverage += low
+        engine.dispose()
+
+    # ru_maxrss is in kilobytes on Linux
+    print(f"Peak process RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+
+    for n_rows, selection, kpi, share in low_coverage:
+        print(f"LOW COVERAGE {n_rows:,} rows {selection} {kpi}: {share:.2f} < {MIN_COVERAGE}")
+
+    slower = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for result, before in slower:
+            print(f"REGRESSION {result.rows:,} rows {result.stage}: {before:.4f} s -> {result.seconds:.4f} s")
+    return 1 if slower or low_coverage else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""Plotly figure template and memoized chart builders for the dashboard panels"""
+from collections import OrderedDict
+import functools
+import threading
+
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from aggregations import DAY_NAMES
+from perf import instrumented
+
+
+PRIMARY_COLOR = '#1E3A8A'
+SECONDARY_COLOR = '#93C5FD'
+GRID_COLOR = 'rgba(200,200,200,0.2)'
+FIGURE_CACHE_SIZE = 128
+
+# Shared layout every panel used to repeat in its own update_layout call
+DASHBOARD_TEMPLATE = go.layout.Template(pio.templates['plotly'])
+DASHBOARD_TEMPLATE.layout.update(
+    height=400,
+    margin=dict(t=20, b=20, l=20, r=20),
+    plot_bgcolor='rgba(0,0,0,0)',
+    paper_bgcolor='rgba(0,0,0,0)',
+    xaxis=dict(showgrid=False, gridcolor=GRID_COLOR),
+    yaxis=dict(showgrid=True, gridcolor=GRID_COLOR),
+    piecolorway=px.colors.sequential.Blues_r,
+)
+
+
+def _frame_key(frame):
+    """Content hash of a small aggregated frame"""
+    hashed = pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes()
+    return tuple(frame.columns), hashed
+
+
+def memoize_figure(builder):
+    """Reuse the figure built for identical aggregated input, keeping the most recent FIGURE_CACHE_SIZE"""
+    cache = OrderedDict()
+    lock = threading.Lock()
+    # Only actual builds are recorded, not cache hits
+    builder = instrumented(f"figure[{builder.__name__.removesuffix('_figure')}]")(builder)
+
+    @functools.wraps(builder)
+    def wrapper(frame):
+        key = _frame_key(frame)
+        with lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        fig = builder(frame)
+        with lock:
+            cache[key] = fig
+            while len(cache) > FIGURE_CACHE_SIZE:
+                cache.popitem(last=False)
+        return fig
+
+    wrapper.cache = cache
+    return wrapper
+
+
+@memoize_figure
+def sales_trend_figure(trend):
+    """Line chart of revenue per period with its rolling average; hover shows the period-over-period changes"""
+    return go.Figure(
+        [
+            go.Scatter(
+                x=trend['Period'], y=trend['Total Sale'], name='Revenue',
+                customdata=trend[['Change', 'Year-over-Year Change']].fillna(0).to_numpy(),
+                mode='lines+markers', line=dict(color=PRIMARY_COLOR, width=3, shape='linear'),
+                hovertemplate=('Period=%{x}<br>Revenue ($)=%{y:$,.2f}<br>vs previous=%{customdata[0]:+.1%}'
+                               '<br>vs year before=%{customdata[1]:+.1%}<extra></extra>'),
+            ),
+            go.Scatter(
+                x=trend['Period'], y=trend['Rolling Average'], name='Rolling average',
+                mode='lines', line=dict(color=SECONDARY_COLOR, width=2, dash='dash'),
+                hovertemplate='Period=%{x}<br>Rolling average ($)=%{y:$,.2f}<extra></extra>',
+            ),
+        ],
+        layout=dict(
+            template=DASHBOARD_TEMPLATE,
+            yaxis_title="Revenue ($)",
+            yaxis_tickformat="$,.0f",
+            legend=dict(orientation="h", yanchor="bottom", y=1.0, xanchor="right", x=1),
+        ),
+    )
+
+
+@memoize_figure
+def top_products_figure(top_products):
+    """Horizontal bar chart of the top products by revenue"""
+    return go.Figure(
+        go.Bar(
+            x=top_products['Total Sale'], y=top_products['Product'], orientation='h',
+            marker_color=PRIMARY_COLOR,
+            hovertemplate='Revenue ($)=%{x}<br>Product=%{y}<extra></extra>',
+        ),
+        layout=dict(
+            template=DASHBOARD_TEMPLATE,
+            xaxis_title="Revenue ($)",
+            xaxis_tickformat="$,.0f",
+            xaxis_showgrid=True,
+            yaxis_showgrid=False,
+            yaxis={'categoryorder': 'total ascending'},
+        ),
+    )
+
+
+@memoize_figure
+def city_sales_figure(city_sales):
+    """Donut chart of each city's share of revenue"""
+    return go.Figure(
+        go.Pie(
+            values=city_sales['Total Sale'], labels=city_sales['City'], hole=0.4,
+            textposition='inside', textinfo='percent+label',
+            marker=dict(line=dict(color='#FFFFFF', width=2)),
+            hovertemplate='City=%{label}<br>Total Sale=%{value}<extra></extra>',
+        ),
+        layout=dict(
+            template=DASHBOARD_TEMPLATE,
+            legend_title_text='',
+            legend=dict(orientation="v", yanchor="middle", y=0.5, xanchor="right", x=1.1),
+        ),
+    )
+
+
+@memoize_figure
+def hourly_orders_figure(hourly_orders):
+    """Line chart of order lines per hour of day"""
+    return go.Figure(
+        go.Scatter(
+            x=hourly_orders['Hour'], y=hourly_orders['Order ID'],
+            mode='lines+markers', line=dict(color=PRIMARY_COLOR, width=3, shape='spline'),
+            hovertemplate='Hour of Day=%{x}<br>Number of Orders=%{y}<extra></extra>',
+        ),
+        layout=dict(
+            template=DASHBOARD_TEMPLATE,
+            xaxis_title="Hour of Day",
+            yaxis_title="Number of Orders",
+            xaxis=dict(tickmode='linear', tick0=0, dtick=2),
+        ),
+    )
+
+
+@memoize_figure
+def day_sales_figure(day_sales):
+    """Bar chart of revenue per day of week"""
+    return go.Figure(
+        go.Bar(
+            x=day_sales['Day'], y=day_sales['Total Sale'], marker_color=PRIMARY_COLOR,
+            hovertemplate='Day=%{x}<br>Revenue ($)=%{y}<extra></extra>',
+        ),
+        layout=dict(
+            template=DASHBOARD_TEMPLATE,
+            yaxis_title="Revenue ($)",
+            yaxis_tickformat="$,.0f",
+            xaxis={'categoryorder': 'array', 'categoryarray': DAY_NAMES},
+        ),
+    )
+
+
+@memoize_figure
+def product_aov_figure(product_aov):
+    """Bar chart of the products with the highest average order value"""
+    return go.Figure(
+        go.Bar(
+            x=product_aov['Product'], y=product_aov['AOV'], marker_color=PRIMARY_COLOR,
+            hovertemplate='Product=%{x}<br>Average Order Value ($)=%{y}<extra></extra>',
+        ),
+        layout=dict(
+            template=DASHBOARD_TEMPLATE,
+            yaxis_title="Average Order Value ($)",
+            yaxis_tickformat="$,.2f",
+            xaxis={'tickangle': 45},
+        ),
+    )
@@ -0,0 +1,136 @@
+"""Daily rollup cube of the sales snapshot that answers every chart panel"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from aggregations import aggregate_panels, distinct_orders
+from perf import instrumented
+from snapshot import concat_categorical
+from trends import HourlySeries
+
+
+CUBE_KEYS = ['Order Date', 'Hour', 'Product', 'City']
+CUBE_MEASURES = ['Total Sale', 'Quantity Ordered', 'Rows', 'Order Lines']
+
+
+@dataclass
+class SalesCube:
+    """Measures per (day, hour, product, city) cell plus the order-to-cell pairs
+
+    ``cells`` holds summed revenue and units, the row and order-line counts and
+    the number of distinct orders in each cell. ``order_cells`` lists every
+    distinct (Order ID, cell) pair, which keeps distinct order counts exact when
+    cubes are merged; ``shared`` is the subset for orders spanning more than one
+    cell, the only ones that can be counted twice when cells are combined.
+    """
+    cells: pd.DataFrame
+    order_cells: pd.DataFrame
+    shared: pd.DataFrame
+
+
+def _finish_cube(cells, order_cells):
+    cells['Orders'] = np.bincount(order_cells['cell'], minlength=len(cells))
+    shared = order_cells[order_cells['Order ID'].duplicated(keep=False)].reset_index(drop=True)
+    return SalesCube(cells, order_cells, shared)
+
+
+@instrumented('cube')
+def build_cube(sales_data):
+    """Roll the snapshot up into cube cells"""
+    keys = [sales_data['Order Date'].dt.normalize(), sales_data['Hour'], sales_data['Product'], sales_data['City']]
+    grouped = sales_data.groupby(keys, observed=True, dropna=False, sort=False)
+    cells = grouped.agg(**{
+        'Total Sale': ('Total Sale', 'sum'),
+        'Quantity Ordered': ('Quantity Ordered', 'sum'),
+        'Rows': ('Total Sale', 'size'),
+        'Order Lines': ('Order ID', 'count'),
+    }).reset_index()
+
+    order_cells = pd.DataFrame({
+        'Order ID': sales_data['Order ID'].to_numpy(),
+        'cell': grouped.ngroup().to_numpy(dtype='int32'),
+    }).dropna().drop_duplicates(ignore_index=True)
+
+    return _finish_cube(cells, order_cells)
+
+
+def merge_cubes(cube, new_cube):
+    """Merge the cube of newly appended rows into an existing cube"""
+    cells = concat_categorical(cube.cells[CUBE_KEYS + CUBE_MEASURES], new_cube.cells[CUBE_KEYS + CUBE_MEASURES])
+    grouped = cells.groupby(CUBE_KEYS, observed=True, dropna=False, sort=False)
+    merged = grouped[CUBE_MEASURES].sum().reset_index()
+
+    # Old and new cell numbers both point into the merged cells
+    cell = grouped.ngroup().to_numpy(dtype='int32')
+    offset = len(cube.cells)
+    order_cells = pd.concat([
+        cube.order_cells.assign(cell=cell[cube.order_cells['cell'].to_numpy()]),
+        new_cube.order_cells.assign(cell=cell[offset + new_cube.order_cells['cell'].to_numpy()]),
+    ]).drop_duplicates(ignore_index=True)
+
+    return _finish_cube(merged, order_cells)
+
+
+def _distinct_orders(cube, mask, selected):
+    """Distinct orders overall and per product for the selected cells"""
+    product = selected['Product'].array
+    total_orders = int(selected['Orders'].sum())
+    product_orders = np.bincount(product.codes[product.codes >= 0], selected['Orders'][product.codes >= 0],
+                                 len(product.categories))
+
+    # Orders spanning several selected cells were counted once per cell
+    shared = cube.shared[mask[cube.shared['cell'].to_numpy()]]
+    shared_product = pd.Categorical.from_codes(
+        cube.cells['Product'].cat.codes.to_numpy()[shared['cell'].to_numpy()], product.categories
+    )
+    unique_orders, unique_product_orders = distinct_orders(shared['Order ID'], shared_product)
+    shared_codes = shared_product.codes[shared_product.codes >= 0]
+    total_orders -= len(shared) - unique_orders
+    product_orders -= np.bincount(shared_codes, minlength=len(product.categories)) - unique_product_orders
+    return total_orders, product_orders
+
+
+def _cell_mask(cube, state):
+    """Boolean mask of the cube cells matching the filter state"""
+    cells = cube.cells
+    mask = (cells['Order Date'] >= state.start_date.normalize()) & (cells['Order Date'] <= state.end_date)
+    if state.products:
+        mask &= cells['Product'].isin(state.products)
+    if state.cities:
+        mask &= cells['City'].isin(state.cities)
+    return mask.to_numpy()
+
+
+@instrumented('panels[cube]', rows_in=lambda args, result: args[0].cells)
+def cube_panels(cube, state):
+    """Compute every panel from the cube cells matching the filter state"""
+    mask = _cell_mask(cube, state)
+    selected = cube.cells[mask]
+
+    total_orders, product_orders = _distinct_orders(cube, mask, selected)
+    return aggregate_panels(
+        product=selected['Product'].array,
+        city=selected['City'].array,
+        hour=selected['Hour'].to_numpy(),
+        weekday=selected['Order Date'].dt.dayofweek.to_numpy(),
+        revenue=selected['Total Sale'].to_numpy(),
+        units=selected['Quantity Ordered'].to_numpy(),
+        rows=selected['Rows'].to_numpy(),
+        lines=selected['Order Lines'].to_numpy(),
+        total_orders=total_orders,
+        product_orders=product_orders,
+    )
+
+
+@instrumented('trend[cube]', rows_in=lambda args, result: args[0].cells)
+def cube_trend(cube, state):
+    """Hourly revenue, units and order lines of the cube cells matching the filter state"""
+    selected = cube.cells[_cell_mask(cube, state)]
+    return HourlySeries.from_hours(
+        selected['Order Date'] + pd.to_timedelta(selected['Hour'], unit='h'),
+        selected['Total Sale'].to_numpy(),
+        selected['Quantity Ordered'].to_numpy(),
+        selected['Order Lines'].to_numpy(),
+        rows=selected['Rows'].to_numpy(),
+    )
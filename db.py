@@ -0,0 +1,98 @@
+"""Database engine configuration from Streamlit secrets and environment variables"""
+from dataclasses import dataclass, fields
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+
+ENV_PREFIX = 'SALES_DB_'
+
+
+@dataclass(frozen=True)
+class DBSettings:
+    """Connection URLs, pool sizing, panel concurrency and timeouts for the sales database"""
+    url: str = None
+    replica_url: str = None
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: int = 30
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    connect_timeout: int = 10
+    statement_timeout_ms: int = 30000
+    # Panel queries run concurrently across all sessions, and how long a page waits for them
+    panel_workers: int = 4
+    panel_timeout: int = 30
+
+
+def _parse(value, kind):
+    if kind is bool and isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return kind(value)
+
+
+def load_db_settings(secrets=None, environ=None):
+    """Read settings from a [database] secrets section, overridden by SALES_DB_* variables
+
+    DATABASE_URL, as set by hosting platforms such as Render, is used when no
+    URL is configured otherwise.
+    """
+    secrets = dict(secrets or {})
+    environ = os.environ if environ is None else environ
+    defaults = DBSettings()
+
+    values = {}
+    for field in fields(DBSettings):
+        value = environ.get(ENV_PREFIX + field.name.upper(), secrets.get(field.name))
+        if value is None or value == '':
+            continue
+        default = getattr(defaults, field.name)
+        values[field.name] = value if default is None else _parse(value, type(default))
+
+    values.setdefault('url', environ.get('DATABASE_URL'))
+    if not values['url']:
+        raise ValueError("No database URL configured: set [database] url in secrets, SALES_DB_URL or DATABASE_URL")
+    return DBSettings(**values)
+
+
+def _engine_url(url):
+    """Parse url, pinning plain postgresql:// URLs to the psycopg2 driver used for COPY"""
+    url = make_url(url)
+    if url.drivername in ('postgres', 'postgresql'):
+        url = url.set(drivername='postgresql+psycopg2')
+    return url
+
+
+def create_sales_engine(settings):
+    """Create the pooled engine used for every dashboard read, preferring the replica"""
+    url = _engine_url(settings.replica_url or settings.url)
+    options = {}
+    if url.get_backend_name() == 'postgresql':
+        options['client_encoding'] = 'utf8'
+        options['connect_args'] = {
+            'connect_timeout': settings.connect_timeout,
+            'options': f'-c statement_timeout={settings.statement_timeout_ms}',
+        }
+
+    return create_engine(
+        url,
+        pool_size=settings.pool_size,
+        max_overflow=settings.max_overflow,
+        pool_timeout=settings.pool_timeout,
+        pool_recycle=settings.pool_recycle,
+        pool_pre_ping=settings.pool_pre_ping,
+        **options,
+    )
+
+
+def db_error_message(error):
+    """Short, user-facing description of a database error"""
+    if isinstance(error, PoolTimeoutError):
+        return "All database connections are busy. Please try again in a moment."
+    # Raised both wrapped by SQLAlchemy and bare from the raw COPY connection,
+    # or by the panel pool when a panel outlasts its deadline
+    if isinstance(error, TimeoutError) or 'canceling statement due to statement timeout' in str(error):
+        return "The database query timed out. Try a narrower date range or fewer filters."
+    return f"Data fetching error: {error}"
@@ -0,0 +1,127 @@
+"""Chunked export of the filtered sales rows to CSV, gzip-compressed CSV or Parquet"""
+from collections import OrderedDict
+import gzip
+import io
+import tempfile
+import threading
+import time
+
+from perf import instrumented
+
+
+# Label -> (file name, MIME type)
+EXPORT_FORMATS = {
+    'CSV': ('sales_data_export.csv', 'text/csv'),
+    'CSV (gzip)': ('sales_data_export.csv.gz', 'application/gzip'),
+    'Parquet': ('sales_data_export.parquet', 'application/vnd.apache.parquet'),
+}
+CHUNK_ROWS = 50_000
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+
+def snapshot_chunks(sales_data, rows, chunk_rows=CHUNK_ROWS):
+    """Yield the selected snapshot rows a chunk at a time, gathering one chunk per step"""
+    if isinstance(rows, slice):
+        rows = range(*rows.indices(len(sales_data)))
+    if len(rows) == 0:
+        # Still emit the column header
+        yield sales_data.iloc[:0]
+    for offset in range(0, len(rows), chunk_rows):
+        part = rows[offset:offset + chunk_rows]
+        yield sales_data.iloc[slice(part.start, part.stop) if isinstance(part, range) else part]
+
+
+def _write_csv(chunks, binary_file):
+    text_file = io.TextIOWrapper(binary_file, encoding='utf-8', newline='')
+    header = True
+    for chunk in chunks:
+        chunk.to_csv(text_file, index=False, header=header)
+        header = False
+    text_file.flush()
+    text_file.detach()
+
+
+def _write_parquet(chunks, binary_file):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    for chunk in chunks:
+        if writer is None:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            writer = pq.ParquetWriter(binary_file, table.schema)
+        else:
+            table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+
+@instrumented('export')
+def write_export(chunks, export_format):
+    """Write the chunks to a spooled temporary file that moves to disk once it grows large"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    if export_format == 'Parquet':
+        _write_parquet(chunks, spool)
+    elif export_format == 'CSV (gzip)':
+        with gzip.GzipFile(fileobj=spool, mode='wb') as compressed:
+            _write_csv(chunks, compressed)
+    else:
+        _write_csv(chunks, spool)
+    spool.seek(0)
+    return spool
+
+
+class ExportCache:
+    """Bounded LRU of recent exports, kept in spooled temporary files
+
+    The rows are never held in memory while an export is written, but the
+    download button takes the finished file as bytes, so each download still
+    holds one full copy of the file in the worker's memory while it is served.
+    """
+
+    def __init__(self, max_entries=4, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """Return the export bytes for key, calling build() to write it on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+            else:
+                entry = None
+        # Read and build outside the lock so other sessions' downloads are not held up
+        if entry is not None:
+            data = self._read(entry)
+            if data is not None:
+                return data
+
+        entry = (time.monotonic(), build(), threading.Lock())
+        data = self._read(entry)
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                evicted.append(previous)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        for old in evicted:
+            # Waits for a download still reading the file
+            with old[2]:
+                old[1].close()
+        return data
+
+    @staticmethod
+    def _read(entry):
+        """The entry's file as bytes, or None once it has been evicted and closed"""
+        _, spool, lock = entry
+        with lock:
+            if spool.closed:
+                return None
+            spool.seek(0)
+            return spool.read()
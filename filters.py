@@ -0,0 +1,118 @@
+"""Sidebar filter state and the in-memory filtering path"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from perf import instrumented
+
+
+@dataclass(frozen=True)
+class FilterState:
+    """Date range, products and cities selected in the sidebar"""
+    start_date: pd.Timestamp
+    end_date: pd.Timestamp
+    products: tuple = ()
+    cities: tuple = ()
+
+
+def make_filter_state(start_date, end_date, products=(), cities=()):
+    """Build a FilterState covering whole days from start_date to end_date"""
+    start = pd.Timestamp(start_date)
+    end = pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+    return FilterState(start, end, tuple(products), tuple(cities))
+
+
+class FilterIndex:
+    """Positional index over a snapshot sorted by Order Date
+
+    The date range becomes a binary-search slice and product/city filters a
+    lookup on the categorical codes inside that slice, so no boolean mask over
+    the whole snapshot and no intermediate sub-frames are built.
+    """
+
+    def __init__(self, order_dates, product_codes, products, city_codes, cities):
+        self.order_dates = order_dates
+        self.product_codes = product_codes
+        self.products = products
+        self.city_codes = city_codes
+        self.cities = cities
+
+    @classmethod
+    @instrumented('filter_index', rows_in=lambda args, result: args[1])
+    def from_snapshot(cls, sales_data):
+        """Build the index from a snapshot sorted by Order Date"""
+        return cls(
+            sales_data['Order Date'].to_numpy(),
+            sales_data['Product'].cat.codes.to_numpy(),
+            sales_data['Product'].cat.categories,
+            sales_data['City'].cat.codes.to_numpy(),
+            sales_data['City'].cat.categories,
+        )
+
+    @staticmethod
+    def merge(index, new_index):
+        """Append the index of newer rows, remapping their codes like append_snapshot does"""
+        products = index.products.union(new_index.products, sort=False)
+        cities = index.cities.union(new_index.cities, sort=False)
+        return FilterIndex(
+            np.concatenate([index.order_dates, new_index.order_dates]),
+            _append_codes(index.product_codes, new_index.product_codes, new_index.products, products),
+            products,
+            _append_codes(index.city_codes, new_index.city_codes, new_index.cities, cities),
+            cities,
+        )
+
+    @instrumented('filter[index]', rows_in=lambda args, result: args[0].order_dates)
+    def rows(self, state):
+        """Return the matching rows as a slice, or as positions when products or cities are filtered"""
+        start = np.searchsorted(self.order_dates, np.datetime64(state.start_date), side='left')
+        stop = np.searchsorted(self.order_dates, np.datetime64(state.end_date), side='right')
+
+        match = None
+        if state.products:
+            match = _code_lookup(self.products, state.products)[self.product_codes[start:stop] + 1]
+        if state.cities:
+            city_match = _code_lookup(self.cities, state.cities)[self.city_codes[start:stop] + 1]
+            match = city_match if match is None else match & city_match
+
+        if match is None:
+            return slice(start, stop)
+        return start + np.flatnonzero(match)
+
+
+def _append_codes(codes, new_codes, new_categories, categories):
+    """Append codes of newer rows after translating them to the merged categories"""
+    new_codes = np.append(categories.get_indexer(new_categories), -1)[new_codes]
+    dtype = np.min_scalar_type(-len(categories) - 1)
+    return np.concatenate([codes, new_codes]).astype(dtype, copy=False)
+
+
+def _code_lookup(categories, selected):
+    """Boolean table indexed by code + 1 that is True for the selected categories"""
+    lookup = np.zeros(len(categories) + 1, dtype=bool)
+    positions = categories.get_indexer(list(selected))
+    lookup[positions[positions >= 0] + 1] = True
+    return lookup
+
+
+@instrumented('filter[mask]')
+def filter_frame(sales_data, state, index=None):
+    """Apply the filter state to the preprocessed sales frame"""
+    if index is not None:
+        # One slice or gather instead of a chain of masks and copies
+        return sales_data.iloc[index.rows(state)]
+
+    filtered_data = sales_data[
+        (sales_data['Order Date'] >= state.start_date) &
+        (sales_data['Order Date'] <= state.end_date)
+    ]
+
+    # Apply product and city filters if selected
+    if state.products:
+        filtered_data = filtered_data[filtered_data['Product'].isin(state.products)]
+
+    if state.cities:
+        filtered_data = filtered_data[filtered_data['City'].isin(state.cities)]
+
+    return filtered_data
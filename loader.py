@@ -0,0 +1,191 @@
+"""Shared sales snapshot with incremental, background refreshes"""
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from snapshot import append_snapshot, build_snapshot
+
+
+logger = logging.getLogger('sales_dashboard.cache')
+
+# Appends never see rows inserted or corrected at or before the high-water
+# mark, so rows last loaded in full longer ago than this are loaded in full again
+MAX_SNAPSHOT_AGE = 24 * 3600
+
+
+class SnapshotStore:
+    """Holds the preprocessed snapshot and appends new rows past the Order Date high-water mark
+
+    The first call to get() loads the full table. After that, once the refresh
+    interval has elapsed, get() returns the current snapshot immediately and
+    fetches only newer rows on a background thread. Registered aggregates are
+    merged with the aggregates of the new rows instead of being rebuilt. Once
+    the rows were loaded in full more than max_age seconds ago, the next
+    refresh reloads the whole table instead, in the background, and swaps it in.
+
+    With a cache (see parquet_cache), the first load reads the snapshot from
+    local disk and reconciles with the database in the background, and every
+    load or append is written back to it on a background thread. A cache
+    whose rows were loaded in full more than max_age seconds ago is ignored
+    and the full table is loaded instead.
+    """
+
+    def __init__(self, fetch_rows, refresh_interval=600, cache=None, max_age=MAX_SNAPSHOT_AGE):
+        self._fetch_rows = fetch_rows
+        self.cache = cache
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._aggregates = {}
+        self._load_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # Swapped as a whole so readers always see a matching snapshot, aggregates
+        # and version; the version goes up whenever the snapshot changes
+        self._state = (pd.DataFrame(), {}, 0)
+        self.high_water_mark = None
+        # When the rows were last loaded in full from the database
+        self.built_at = None
+        self.loaded_at = None
+        self.last_error = None
+
+    def register_aggregate(self, name, build, merge):
+        """Maintain build(snapshot) under name, updated with merge(current, build(new_rows))"""
+        self._aggregates[name] = (build, merge)
+        snapshot, derived, version = self._state
+        if not snapshot.empty:
+            self._state = (snapshot, {**derived, name: build(snapshot)}, version)
+
+    def get(self):
+        """Return (snapshot, aggregates, version), loading on first use and refreshing in the background
+
+        Results derived from the snapshot should be keyed on the returned
+        version, which always matches the returned snapshot.
+        """
+        if self.loaded_at is None:
+            with self._load_lock:
+                if self.loaded_at is None:
+                    self._load()
+        elif time.monotonic() - self.loaded_at >= self.refresh_interval:
+            self.refresh(wait=False)
+        return self._state
+
+    def refresh(self, wait=True):
+        """Fetch rows newer than the high-water mark and append them, or reload the table once it is too old"""
+        if not self._refresh_lock.acquire(blocking=wait):
+            return  # a refresh is already running
+        if wait:
+            try:
+                self._update()
+            finally:
+                self._refresh_lock.release()
+        else:
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self._update()
+        finally:
+            self._refresh_lock.release()
+
+    def _reload_due(self):
+        return self.max_age is not None and self.built_at is not None and time.time() - self.built_at >= self.max_age
+
+    def _update(self):
+        if self._reload_due():
+            self._reload()
+        else:
+            self._append_new_rows()
+
+    def _initial_snapshot(self):
+        """The cached snapshot if there is a recent enough one, else the full table; returns (snapshot, from_cache)"""
+        if self.cache is not None:
+            try:
+                cached = self.cache.load(max_age=self.max_age)
+            except Exception:
+                logger.warning("Ignoring unreadable snapshot cache", exc_info=True)
+                cached = None
+            if cached is not None:
+                snapshot, self.built_at = cached
+                return snapshot, True
+        built_at = time.time()
+        snapshot = build_snapshot(self._fetch_rows(None))
+        self.built_at = built_at
+        return snapshot, False
+
+    def _save_to_cache(self, snapshot, built_at):
+        try:
+            self.cache.save(snapshot, built_at)
+        except Exception:
+            # The cache only speeds up cold starts; failing to write it is not fatal
+            logger.warning("Could not write the snapshot cache", exc_info=True)
+
+    def _save_in_background(self, snapshot, built_at):
+        if self.cache is not None and not snapshot.empty:
+            threading.Thread(target=self._save_to_cache, args=(snapshot, built_at), daemon=True).start()
+
+    def _build_aggregates(self, snapshot):
+        """Every registered aggregate built over the whole snapshot"""
+        if snapshot.empty:
+            return {}
+        return {name: build(snapshot) for name, (build, merge) in self._aggregates.items()}
+
+    def _merge_aggregates(self, derived, new_rows):
+        """The aggregates updated with those of newly appended rows, built over those rows only"""
+        return {
+            name: merge(derived[name], build(new_rows)) if name in derived else build(new_rows)
+            for name, (build, merge) in self._aggregates.items()
+        }
+
+    def _load(self):
+        try:
+            snapshot, cached = self._initial_snapshot()
+        except Exception as e:
+            self.last_error = e
+            return
+        self._swap(snapshot, self._build_aggregates(snapshot))
+        if cached:
+            # Serve the cached rows right away and fetch anything newer meanwhile
+            self.refresh(wait=False)
+        else:
+            self._save_in_background(snapshot, self.built_at)
+
+    def _reload(self):
+        built_at = time.time()
+        try:
+            snapshot = build_snapshot(self._fetch_rows(None))
+            derived = self._build_aggregates(snapshot)
+        except Exception as e:
+            self.last_error = e
+            logger.warning("Could not reload the snapshot", exc_info=True)
+            self.loaded_at = time.monotonic()  # back off until the next interval
+            return
+        self.built_at = built_at
+        self._swap(snapshot, derived)
+        # Replaces the cached partitions, as the rows were loaded later
+        self._save_in_background(snapshot, built_at)
+
+    def _append_new_rows(self):
+        snapshot, derived, version = self._state
+        try:
+            new_rows = build_snapshot(self._fetch_rows(self.high_water_mark))
+            if not new_rows.empty:
+                derived = self._merge_aggregates(derived, new_rows)
+                snapshot = append_snapshot(snapshot, new_rows)
+        except Exception as e:
+            self.last_error = e
+            logger.warning("Could not append new rows to the snapshot", exc_info=True)
+            self.loaded_at = time.monotonic()  # back off until the next interval
+            return
+
+        if snapshot is not self._state[0]:
+            self._save_in_background(snapshot, self.built_at)
+        self._swap(snapshot, derived)
+
+    def _swap(self, snapshot, derived):
+        version = self._state[2]
+        self._state = (snapshot, derived, version if snapshot is self._state[0] else version + 1)
+        if not snapshot.empty:
+            self.high_water_mark = snapshot['Order Date'].max()
+        self.loaded_at = time.monotonic()
+        self.last_error = None
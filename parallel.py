@@ -0,0 +1,86 @@
+"""Bounded thread pool that computes independent dashboard panels concurrently"""
+from concurrent.futures import ThreadPoolExecutor, wait
+import contextvars
+from functools import partial
+import time
+
+from perf import stage
+
+
+class PanelPool:
+    """Runs named, independent panel computations concurrently and collects each result or error
+
+    The pool is shared by every session, so max_workers bounds the panel
+    queries in flight at once and should stay within the database pool size.
+    Tasks run in a copy of the caller's context, which records their stages
+    into the caller's perf run. With max_workers of 1 or less tasks run one
+    after another on the calling thread.
+    """
+
+    def __init__(self, max_workers=4, timeout=30):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix='panel') if max_workers > 1 else None
+
+    def run(self, tasks, timeout=None):
+        """Call every task of a {name: callable} dict; returns ({name: result}, {name: exception})
+
+        A task that has not finished within timeout seconds of the call is
+        reported as a TimeoutError. It is cancelled if it has not started;
+        a running query is left to the database statement timeout.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        results, errors = {}, {}
+        if self._executor is None:
+            for name, task in tasks.items():
+                try:
+                    results[name] = _call(name, task)
+                except Exception as e:
+                    errors[name] = e
+            return results, errors
+
+        futures = {
+            name: self._executor.submit(contextvars.copy_context().run, _call, name, task)
+            for name, task in tasks.items()
+        }
+        wait(futures.values(), timeout=timeout)
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                errors[name] = TimeoutError(f"The {name} panel did not finish within {timeout} s")
+            elif future.exception() is not None:
+                errors[name] = future.exception()
+            else:
+                results[name] = future.result()
+        return results, errors
+
+    def start(self, name, task):
+        """Start one task alongside others; returns a callable that waits for and returns its result
+
+        The callable raises the task's exception, or a TimeoutError once
+        timeout seconds have passed since the start. Without a thread pool
+        the task runs when the callable is called.
+        """
+        if self._executor is None:
+            return partial(_call, name, task)
+
+        started = time.monotonic()
+        future = self._executor.submit(contextvars.copy_context().run, _call, name, task)
+
+        def result():
+            try:
+                return future.result(timeout=max(self.timeout - (time.monotonic() - started), 0))
+            except TimeoutError:
+                if future.done():
+                    raise  # raised by the task itself
+                future.cancel()
+                raise TimeoutError(f"The {name} panel did not finish within {self.timeout} s") from None
+        return result
+
+
+def _call(name, task):
+    with stage(f'panel[{name}]'):
+        return task()
+
+
+# Used when no pool is passed: one task after another, still reporting errors per panel
+SERIAL = PanelPool(max_workers=1)
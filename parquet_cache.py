@@ -0,0 +1,168 @@
+"""Preprocessed snapshot persisted on local disk as monthly Parquet partitions"""
+from contextlib import contextmanager
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from perf import instrumented
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = 'writer.lock'
+# Bump whenever the snapshot columns or their types change, so stale caches are ignored
+CACHE_VERSION = 1
+# Partition of rows without an order date
+UNDATED = 'undated'
+
+
+@contextmanager
+def _cache_lock(root):
+    """Serialize writers, including those of other server processes sharing the directory"""
+    with open(os.path.join(root, LOCK_FILE), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _month_keys(order_dates):
+    """year * 100 + month of each row, -1 without an order date"""
+    return (order_dates.dt.year * 100 + order_dates.dt.month).fillna(-1).astype('int64').to_numpy()
+
+
+def _partition_name(key):
+    # 'undated' sorts after every 'YYYY-MM', as NaT sorts after every date
+    return UNDATED if key < 0 else f'{key // 100:04d}-{key % 100:02d}'
+
+
+class ParquetSnapshotCache:
+    """The snapshot as one Parquet file per order month plus a manifest of the source high-water mark
+
+    Rows are appended past the high-water mark, so a save only rewrites the
+    month holding the previous mark and any later months. The manifest is
+    replaced last; rows a crash leaves beyond its mark are dropped on load and
+    fetched again. source identifies the database the rows came from, and a
+    cache written for another source or CACHE_VERSION is ignored.
+
+    The manifest also records built_at, when the rows were last loaded in
+    full from the database. Appends never pick up rows inserted or corrected
+    at or before the mark, so load() ignores a cache built longer than
+    max_age seconds ago, and saving a snapshot built later rewrites every
+    partition.
+    """
+
+    def __init__(self, root, source=None):
+        self.root = root
+        self.source = source
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, partition):
+        return os.path.join(self.root, f'month={partition}.parquet')
+
+    def manifest(self):
+        """The manifest if it matches this source and version, else None"""
+        try:
+            with open(os.path.join(self.root, MANIFEST_FILE)) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if manifest.get('version') != CACHE_VERSION or manifest.get('source') != self.source:
+            return None
+        return manifest
+
+    @instrumented('cache_load', rows_in=lambda args, result: result)
+    def load(self, max_age=None):
+        """Read every partition, memory-mapping the files; returns (snapshot, built_at)
+
+        Returns None when there is no usable cache or it was built more than
+        max_age seconds ago.
+        """
+        manifest = self.manifest()
+        if manifest is None or not manifest['partitions']:
+            return None
+        # Caches written before built_at was recorded count as expired
+        built_at = manifest.get('built_at', 0)
+        if max_age is not None and time.time() - built_at >= max_age:
+            return None
+
+        tables = [pq.read_table(self._path(partition), memory_map=True) for partition in manifest['partitions']]
+        # Each partition has its own dictionaries; unify them into one set of categories
+        snapshot = pa.concat_tables(tables).unify_dictionaries().to_pandas()
+        # Parquet has no second resolution, so datetimes come back in milliseconds
+        snapshot = snapshot.astype(manifest['datetime_dtypes'])
+        high_water_mark = pd.Timestamp(manifest['high_water_mark'])
+        if (snapshot['Order Date'] > high_water_mark).any():
+            snapshot = snapshot[~(snapshot['Order Date'] > high_water_mark)].reset_index(drop=True)
+        return snapshot, built_at
+
+    @instrumented('cache_save', rows_in=lambda args, result: args[1])
+    def save(self, snapshot, built_at=None):
+        """Write the partitions changed since the manifest's high-water mark, then the manifest
+
+        built_at is when the snapshot's rows were loaded in full, now when
+        omitted. A snapshot built later than the cached one replaces it.
+        """
+        if snapshot.empty:
+            return
+        built_at = time.time() if built_at is None else built_at
+        high_water_mark = snapshot['Order Date'].max()
+        with _cache_lock(self.root):
+            manifest = self.manifest()
+            rebuilt = manifest is None or built_at > manifest.get('built_at', 0)
+            previous = None if rebuilt else pd.Timestamp(manifest['high_water_mark'])
+            if previous is not None and previous >= high_water_mark:
+                return  # already as recent, e.g. written by another process
+
+            order_dates = snapshot['Order Date']
+            if previous is None:
+                rows = np.arange(len(snapshot))
+            else:
+                # Rows from the start of the previous mark's month on, including undated ones
+                rows = np.flatnonzero(~(order_dates < previous.to_period('M').start_time).to_numpy())
+
+            changed = []
+            for key, positions in pd.Series(rows).groupby(_month_keys(order_dates.iloc[rows])):
+                partition = _partition_name(key)
+                temporary = f'{self._path(partition)}.{os.getpid()}.tmp'
+                part = snapshot.take(positions.to_numpy())
+                pq.write_table(pa.Table.from_pandas(part, preserve_index=False), temporary)
+                os.replace(temporary, self._path(partition))
+                changed.append(partition)
+
+            kept = manifest['partitions'] if manifest and not rebuilt else []
+            self._write_manifest({
+                'version': CACHE_VERSION,
+                'source': self.source,
+                'high_water_mark': high_water_mark.isoformat(),
+                'rows': len(snapshot),
+                'datetime_dtypes': {name: str(dtype) for name, dtype in snapshot.dtypes.items() if dtype.kind == 'M'},
+                'partitions': sorted(set(kept) | set(changed)),
+                'built_at': built_at if rebuilt else manifest.get('built_at', 0),
+                'written_at': time.time(),
+            })
+            if manifest and rebuilt:
+                # Months the rebuilt snapshot no longer has
+                for partition in set(manifest['partitions']) - set(changed):
+                    try:
+                        os.remove(self._path(partition))
+                    except FileNotFoundError:
+                        pass
+
+    def _write_manifest(self, manifest):
+        temporary = os.path.join(self.root, f'{MANIFEST_FILE}.{os.getpid()}.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(temporary, os.path.join(self.root, MANIFEST_FILE))
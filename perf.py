@@ -0,0 +1,180 @@
+"""Opt-in per-stage timing, row count and memory instrumentation
+
+Stages are recorded into the run started for the current dashboard script run
+(see start_run) and, when configured through the environment, written as JSON
+log lines (SALES_PERF_LOG=1) or to a Prometheus textfile (SALES_PERF_PROM_FILE).
+Otherwise the decorators and context managers cost one context variable lookup.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, fields
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+LOG_ENABLED = os.environ.get('SALES_PERF_LOG', '').strip().lower() in ('1', 'true', 'yes', 'on')
+PROMETHEUS_FILE = os.environ.get('SALES_PERF_PROM_FILE') or None
+ENV_ENABLED = LOG_ENABLED or PROMETHEUS_FILE is not None
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+logger = logging.getLogger('sales_dashboard.perf')
+if LOG_ENABLED and not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+_current_run = ContextVar('perf_run', default=None)
+# Stage -> [calls, seconds, rows out], across every session and background thread
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+@dataclass
+class StageRecord:
+    """Duration, row counts and resident memory change of one stage"""
+    stage: str
+    seconds: float = None
+    rows_in: int = None
+    rows_out: int = None
+    rss_delta_mb: float = None
+
+
+class PerfRun:
+    """Stage records of one dashboard script run"""
+
+    def __init__(self, session=None):
+        self.session = session
+        self.records = []
+
+    def frame(self):
+        """The records as a frame, in the order the stages finished"""
+        return pd.DataFrame([asdict(record) for record in self.records],
+                            columns=[field.name for field in fields(StageRecord)])
+
+
+def start_run(session=None, force=False):
+    """Start recording the stages of this script run, if forced or enabled by the environment"""
+    run = PerfRun(session) if force or ENV_ENABLED else None
+    _current_run.set(run)
+    return run
+
+
+def finish_run():
+    """Publish the metrics at the end of a script run"""
+    if PROMETHEUS_FILE is not None:
+        write_prometheus(PROMETHEUS_FILE)
+
+
+def _rss_bytes():
+    """Resident set size of this process, or None where /proc is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _rows(value):
+    """Row count of a frame, a row selection, panel results, an (orders, cursor) page or a count"""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray, range)):
+        return len(value)
+    if isinstance(value, slice):
+        return None if value.start is None or value.stop is None else value.stop - value.start
+    if isinstance(value, tuple) and value:
+        return _rows(value[0])
+    return getattr(value, 'row_count', None)
+
+
+def _finish(run, record):
+    if run is not None:
+        run.records.append(record)
+    with _totals_lock:
+        totals = _totals.setdefault(record.stage, [0, 0.0, 0])
+        totals[0] += 1
+        totals[1] += record.seconds
+        totals[2] += record.rows_out or 0
+    if LOG_ENABLED:
+        logger.info(json.dumps({'event': 'stage', 'session': run.session if run is not None else None,
+                                **asdict(record)}))
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    """Record the enclosed block as stage name; set rows_out on the yielded record"""
+    run = _current_run.get()
+    record = StageRecord(name, rows_in=rows_in)
+    if run is None and not ENV_ENABLED:
+        yield record
+        return
+
+    rss = _rss_bytes()
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - started
+        after = _rss_bytes()
+        if rss is not None and after is not None:
+            record.rss_delta_mb = (after - rss) / 2**20
+        _finish(run, record)
+
+
+def instrumented(name, rows_in=None):
+    """Record each call as stage name, counting rows in from the first argument and out from the result
+
+    Where the first argument is not the input, as for methods and database
+    queries, rows_in(args, result) returns what to count the rows in from:
+    a frame, a row selection or a count.
+    """
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_run.get() is None and not ENV_ENABLED:
+                return fn(*args, **kwargs)
+            with stage(name, rows_in=_rows(args[0]) if args and rows_in is None else None) as record:
+                result = fn(*args, **kwargs)
+                if rows_in is not None:
+                    record.rows_in = _rows(rows_in(args, result))
+                record.rows_out = _rows(result)
+            return result
+        return wrapper
+    return decorate
+
+
+def prometheus_text():
+    """Stage totals in the Prometheus text exposition format"""
+    with _totals_lock:
+        totals = sorted((stage, list(values)) for stage, values in _totals.items())
+
+    lines = [
+        '# HELP sales_dashboard_stage_seconds Time spent in each dashboard stage',
+        '# TYPE sales_dashboard_stage_seconds summary',
+    ]
+    for name, (calls, seconds, rows) in totals:
+        lines.append(f'sales_dashboard_stage_seconds_count{{stage="{name}"}} {calls}')
+        lines.append(f'sales_dashboard_stage_seconds_sum{{stage="{name}"}} {seconds:.6f}')
+    lines += [
+        '# HELP sales_dashboard_stage_rows_total Rows returned by each dashboard stage',
+        '# TYPE sales_dashboard_stage_rows_total counter',
+    ]
+    for name, (calls, seconds, rows) in totals:
+        lines.append(f'sales_dashboard_stage_rows_total{{stage="{name}"}} {rows}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    """Atomically rewrite path with the current totals, e.g. for node_exporter's textfile collector"""
+    temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(temporary, path)
@@ -0,0 +1,333 @@
+"""PostgreSQL query layer: pushes dashboard filters and aggregations into SQL"""
+from functools import partial
+import tempfile
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from aggregations import DAY_NAMES, RECENT_ORDER_COLUMNS, DetailPanels, PanelResults
+from parallel import SERIAL
+from perf import instrumented
+from trends import HourlySeries
+
+
+TABLE = '"data_ETL"'
+
+# Bulk load paths for the raw rows; read_sql is the original one
+LOAD_MODES = ('read_sql', 'cursor', 'copy')
+BATCH_ROWS = 100_000
+COPY_SPOOL_BYTES = 64 * 1024 * 1024
+
+# Derived columns, mirroring the pandas preprocessing step
+ORDER_DATE = 'CAST("Order Date" AS TIMESTAMP)'
+PRICE_EACH = 'CAST("Price Each" AS NUMERIC)'
+QUANTITY = 'CAST("Quantity Ordered" AS INTEGER)'
+CITY = 'substring("Purchase Address" from \', ([^,]+),\')'
+STATE = 'substring("Purchase Address" from \', [^,]+, ([A-Z]{2}) [0-9]{5}\')'
+ZIP = 'substring("Purchase Address" from \', [^,]+, [A-Z]{2} ([0-9]{5})\')'
+
+FILTERED_CTE = f"""
+WITH filtered AS (
+    SELECT
+        "Order ID" AS order_id,
+        "Product" AS product,
+        {QUANTITY} AS quantity,
+        {PRICE_EACH} AS price_each,
+        {PRICE_EACH} * {QUANTITY} AS total_sale,
+        {ORDER_DATE} AS order_date,
+        "Purchase Address" AS purchase_address,
+        {CITY} AS city,
+        {STATE} AS state,
+        {ZIP} AS zip,
+        ctid AS row_id
+    FROM {TABLE}
+    WHERE {{where}}
+)
+"""
+
+
+def build_filtered_query(state, select_sql):
+    """Wrap select_sql around a parameterized CTE of the rows matching state"""
+    clauses = [f'{ORDER_DATE} BETWEEN :start_date AND :end_date']
+    params = {
+        'start_date': state.start_date.to_pydatetime(),
+        'end_date': state.end_date.to_pydatetime(),
+    }
+    expanding = []
+
+    if state.products:
+        clauses.append('"Product" IN :products')
+        params['products'] = list(state.products)
+        expanding.append(bindparam('products', expanding=True))
+
+    if state.cities:
+        clauses.append(f'{CITY} IN :cities')
+        params['cities'] = list(state.cities)
+        expanding.append(bindparam('cities', expanding=True))
+
+    # Not str.format, which would trip over the {n} quantifiers of the address regexes
+    sql = FILTERED_CTE.replace('{where}', ' AND '.join(clauses)) + select_sql
+    return text(sql).bindparams(*expanding), params
+
+
+def _read(conn, state, select_sql):
+    query, params = build_filtered_query(state, select_sql)
+    return pd.read_sql(query, conn, params=params)
+
+
+def _raw_rows_sql(since, placeholder):
+    sql = f'SELECT * FROM {TABLE}'
+    params = {}
+    if since is not None:
+        sql += f' WHERE {ORDER_DATE} > {placeholder}'
+        params['since'] = pd.Timestamp(since).to_pydatetime()
+    return sql, params
+
+
+def _lift_statement_timeout(conn):
+    """Bulk loads may run longer than the per-query statement timeout; SET LOCAL ends with the transaction"""
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('SET LOCAL statement_timeout = 0'))
+
+
+def _cursor_rows(engine, since, batch_rows):
+    """Stream through a server-side cursor, converting each batch to typed column arrays"""
+    sql, params = _raw_rows_sql(since, ':since')
+    with engine.connect() as conn:
+        _lift_statement_timeout(conn)
+        conn = conn.execution_options(stream_results=True, max_row_buffer=batch_rows)
+        result = conn.execute(text(sql), params)
+        keys = list(result.keys())
+        chunks = {key: [] for key in keys}
+        for batch in result.partitions(batch_rows):
+            frame = pd.DataFrame.from_records(batch, columns=keys)
+            for key in keys:
+                chunks[key].append(frame[key].to_numpy())
+
+    if not chunks or not chunks[keys[0]]:
+        return pd.DataFrame(columns=keys)
+    # Concatenate column by column so only one column is ever held twice
+    return pd.DataFrame({key: np.concatenate(chunks.pop(key)) for key in keys})
+
+
+def _copy_rows(engine, since):
+    """COPY the rows out as CSV into a spooled file and parse it column-wise with Arrow"""
+    sql, params = _raw_rows_sql(since, '%(since)s')
+    spool = tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_BYTES)
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SET LOCAL statement_timeout = 0')
+            query = cursor.mogrify(sql, params).decode()
+            cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)', spool)
+    finally:
+        conn.close()
+
+    spool.seek(0)
+    with spool:
+        return pd.read_csv(spool, engine='pyarrow')
+
+
+@instrumented('load', rows_in=lambda args, result: result)
+def query_raw_rows(engine, since=None, mode='read_sql', batch_rows=BATCH_ROWS):
+    """Fetch raw "data_ETL" rows, optionally only those ordered after since
+
+    mode picks the load path: 'read_sql' builds the frame from Python tuples,
+    'cursor' streams fixed-size batches through a server-side cursor and
+    'copy' uses COPY ... TO STDOUT with a columnar CSV parser.
+    """
+    if mode == 'copy':
+        return _copy_rows(engine, since)
+    if mode == 'cursor':
+        return _cursor_rows(engine, since, batch_rows)
+    if mode != 'read_sql':
+        raise ValueError(f"Unknown load mode: {mode}")
+
+    sql, params = _raw_rows_sql(since, ':since')
+    with engine.connect() as conn:
+        _lift_statement_timeout(conn)
+        return pd.read_sql(text(sql), conn, params=params)
+
+
+@instrumented('filter_options[sql]')
+def query_filter_options(engine):
+    """Fetch the date bounds, products and cities used to populate the sidebar"""
+    with engine.connect() as conn:
+        bounds = conn.execute(text(f'SELECT MIN({ORDER_DATE}), MAX({ORDER_DATE}) FROM {TABLE}')).one()
+        products = conn.execute(text(f'SELECT DISTINCT "Product" FROM {TABLE} ORDER BY 1')).scalars().all()
+        cities = conn.execute(text(
+            f'SELECT DISTINCT {CITY} AS city FROM {TABLE} WHERE {CITY} IS NOT NULL ORDER BY 1'
+        )).scalars().all()
+    return bounds[0], bounds[1], products, cities
+
+
+# One aggregate query per panel; each runs on its own pooled connection
+PANEL_QUERIES = {
+    'kpis': """
+        SELECT COUNT(*) AS row_count,
+               COALESCE(SUM(total_sale), 0) AS total_revenue,
+               COUNT(DISTINCT order_id) AS total_orders,
+               COALESCE(SUM(quantity), 0) AS total_units
+        FROM filtered
+    """,
+    'products': """
+        SELECT product AS "Product", SUM(total_sale) AS "Total Sale"
+        FROM filtered GROUP BY 1 ORDER BY 2 DESC LIMIT 10
+    """,
+    'cities': """
+        SELECT city AS "City", SUM(total_sale) AS "Total Sale"
+        FROM filtered WHERE city IS NOT NULL GROUP BY 1 ORDER BY 2 DESC
+    """,
+    'hourly': """
+        SELECT EXTRACT(HOUR FROM order_date)::int AS "Hour", COUNT(order_id) AS "Order ID"
+        FROM filtered GROUP BY 1 ORDER BY 1
+    """,
+    'days': """
+        SELECT EXTRACT(ISODOW FROM order_date)::int AS isodow, SUM(total_sale) AS "Total Sale"
+        FROM filtered GROUP BY 1 ORDER BY 1
+    """,
+    'aov': """
+        SELECT product AS "Product",
+               COUNT(DISTINCT order_id) AS "Orders",
+               SUM(total_sale) AS "Revenue",
+               SUM(total_sale) / COUNT(DISTINCT order_id) AS "AOV"
+        FROM filtered GROUP BY 1 ORDER BY 4 DESC LIMIT 10
+    """,
+}
+# The KPI row and the charts above the fold; the details section's panels
+# are only queried once its expander is opened
+OVERVIEW_PANELS = ['kpis', 'products', 'cities', 'hourly']
+DETAIL_PANELS = ['days', 'aov']
+# NUMERIC comes back as Decimal; the charts expect floats
+DECIMAL_COLUMNS = {'products': ['Total Sale'], 'cities': ['Total Sale'], 'days': ['Total Sale'], 'aov': ['Revenue', 'AOV']}
+# Exported columns whose inferred type varies with the values of a chunk:
+# NUMERIC comes back as Decimal and a column of NULLs as object. Every chunk
+# is cast to these so a Parquet export keeps the first chunk's schema
+EXPORT_DTYPES = {
+    'Product': 'str', 'Quantity Ordered': 'Int64', 'Price Each': 'float64', 'Purchase Address': 'str',
+    'Total Sale': 'float64', 'City': 'str', 'State': 'str', 'ZIP': 'str', 'Month Name': 'str', 'Day': 'str',
+}
+
+
+def _query_panel(engine, state, name):
+    with engine.connect() as conn:
+        frame = _read(conn, state, PANEL_QUERIES[name])
+    if name in DECIMAL_COLUMNS:
+        frame[DECIMAL_COLUMNS[name]] = frame[DECIMAL_COLUMNS[name]].astype(float)
+    if name == 'days':
+        frame.insert(0, 'Day', frame.pop('isodow').map(lambda d: DAY_NAMES[d - 1]))
+    return frame
+
+
+def _run_panel_queries(engine, state, pool, names):
+    return pool.run({name: partial(_query_panel, engine, state, name) for name in names})
+
+
+@instrumented('panels[sql]', rows_in=lambda args, result: result.row_count)
+def query_panels(engine, state, pool=SERIAL):
+    """Compute the overview panels with one aggregate query per panel, run concurrently on pool
+
+    A failed or timed-out chart panel is left as None with its exception in
+    errors; the KPI query failing raises, since nothing can be shown without it.
+    The day of week and AOV panels are left as None for query_detail_panels.
+    """
+    frames, errors = _run_panel_queries(engine, state, pool, OVERVIEW_PANELS)
+    if 'kpis' in errors:
+        raise errors.pop('kpis')
+    kpis = frames['kpis'].iloc[0]
+
+    return PanelResults(
+        row_count=int(kpis['row_count']),
+        total_revenue=float(kpis['total_revenue']),
+        total_orders=int(kpis['total_orders']),
+        total_units=int(kpis['total_units']),
+        products=frames.get('products'),
+        cities=frames.get('cities'),
+        hourly=frames.get('hourly'),
+        days=None,
+        aov=None,
+        errors=errors,
+    )
+
+
+@instrumented('details[sql]')
+def query_detail_panels(engine, state, pool=SERIAL):
+    """Compute the day of week and AOV panels of the details section concurrently on pool"""
+    frames, errors = _run_panel_queries(engine, state, pool, DETAIL_PANELS)
+    return DetailPanels(days=frames.get('days'), aov=frames.get('aov'), errors=errors)
+
+
+@instrumented('trend[sql]', rows_in=lambda args, result: result.row_count)
+def query_trend(engine, state):
+    """Fetch revenue, units and order lines per hour for the filters; coarser buckets are re-binned locally"""
+    with engine.connect() as conn:
+        hourly = _read(conn, state, """
+            SELECT date_trunc('hour', order_date) AS hour,
+                   SUM(total_sale) AS revenue,
+                   SUM(quantity) AS units,
+                   COUNT(order_id) AS lines,
+                   COUNT(*) AS row_count
+            FROM filtered GROUP BY 1 ORDER BY 1
+        """)
+    return HourlySeries.from_hours(
+        hourly['hour'],
+        hourly['revenue'].astype(float).to_numpy(),
+        hourly['units'].astype(float).to_numpy(),
+        hourly['lines'].to_numpy(),
+        hourly['row_count'].to_numpy(),
+    )
+
+
+def query_export_chunks(engine, state, chunk_rows):
+    """Stream the matching rows, with the snapshot's columns, through a server-side cursor"""
+    select_sql = """
+        SELECT order_id AS "Order ID", product AS "Product", quantity AS "Quantity Ordered",
+               price_each AS "Price Each", order_date AS "Order Date",
+               purchase_address AS "Purchase Address", total_sale AS "Total Sale", city AS "City",
+               state AS "State", zip AS "ZIP",
+               EXTRACT(MONTH FROM order_date)::int AS "Month",
+               to_char(order_date, 'FMMonth') AS "Month Name",
+               EXTRACT(HOUR FROM order_date)::int AS "Hour",
+               to_char(order_date, 'FMDay') AS "Day"
+        FROM filtered ORDER BY order_date
+    """
+    query, params = build_filtered_query(state, select_sql)
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows)
+        for chunk in pd.read_sql(query, conn, params=params, chunksize=chunk_rows):
+            yield chunk.astype(EXPORT_DTYPES)
+
+
+# Rows in are the rows fetched, including the one that tells whether an older page exists
+@instrumented('recent_orders[sql]', rows_in=lambda args, result: len(result[0]) + (result[1] is not None))
+def query_recent_orders(engine, state, limit=10, before=None):
+    """Fetch a page of the latest matching orders with ORDER BY ... LIMIT
+
+    Pages are keyset-paginated on (order_date, row_id), row_id being the
+    physical row address that breaks timestamp ties: pass the cursor returned
+    with one page as before to fetch the next, older page. Returns
+    (orders, cursor); the cursor is None once history is exhausted.
+    """
+    keyset = 'WHERE (order_date, row_id) < (:before_date, CAST(:before_row AS tid))' if before is not None else ''
+    select_sql = f"""
+        SELECT order_id AS "Order ID", product AS "Product", quantity AS "Quantity Ordered",
+               price_each AS "Price Each", total_sale AS "Total Sale",
+               order_date AS "Order Date", city AS "City", CAST(row_id AS TEXT) AS row_id
+        FROM filtered {keyset} ORDER BY order_date DESC, row_id DESC LIMIT :limit
+    """
+    with engine.connect() as conn:
+        query, params = build_filtered_query(state, select_sql)
+        # One extra row tells whether an older page exists
+        params['limit'] = limit + 1
+        if before is not None:
+            params['before_date'], params['before_row'] = before
+        latest_orders = pd.read_sql(query, conn, params=params)
+    latest_orders[['Price Each', 'Total Sale']] = latest_orders[['Price Each', 'Total Sale']].astype(float)
+
+    cursor = None
+    if len(latest_orders) > limit:
+        latest_orders = latest_orders.iloc[:limit]
+        last = latest_orders.iloc[-1]
+        cursor = (last['Order Date'].to_pydatetime(), last['row_id'])
+    return latest_orders[RECENT_ORDER_COLUMNS], cursor
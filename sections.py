@@ -0,0 +1,113 @@
+"""Dashboard sections and a shared cache keyed on the filter inputs each section reads"""
+from collections import OrderedDict
+import contextvars
+from dataclasses import dataclass
+from functools import partial
+import threading
+import time
+
+
+FILTER_INPUTS = ('start_date', 'end_date', 'products', 'cities')
+
+
+@dataclass(frozen=True)
+class Section:
+    """A page section and the FilterState fields it depends on"""
+    name: str
+    depends_on: tuple = FILTER_INPUTS
+
+    def key(self, state):
+        """The part of the filter state this section's result depends on"""
+        return tuple(getattr(state, name) for name in self.depends_on)
+
+
+SECTIONS = {
+    # KPI row and the product, city and hourly charts
+    'overview': Section('overview'),
+    # The same panels estimated from the stratified sample in fast mode
+    'overview_estimate': Section('overview_estimate'),
+    # Hourly sums the sales trend re-bins to the chosen granularity
+    'trend': Section('trend'),
+    # Day of week and average order value charts and the Recent Orders table,
+    # below the fold and built only while their expanders are open
+    'details': Section('details'),
+    'recent_orders': Section('recent_orders'),
+}
+
+
+class SectionCache:
+    """Bounded LRU of section results shared by every session
+
+    Results are keyed on the section, a data version (query engine and snapshot
+    version) and only the filter inputs the section declares, so a rerun
+    that leaves those inputs alone reuses the stored object without recomputing
+    or copying it. Failed builds raise and are not stored, nor are results
+    reporting errors for some of their panels, so the next rerun retries them.
+    """
+
+    def __init__(self, max_entries=256, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Key -> (submitted at, future) of results being computed in the background
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return entry[1]
+        return None
+
+    def peek(self, section, version, state, *args):
+        """Return the stored result for section under state, or None, without building it"""
+        return self._lookup((section.name, version, section.key(state), args))
+
+    def get(self, section, version, state, build, *args):
+        """Return the result for section under state, calling build(*args) on a miss
+
+        args, such as a page cursor, are part of the key.
+        """
+        key = (section.name, version, section.key(state), args)
+        result = self._lookup(key)
+        if result is not None:
+            return result
+
+        result = build(*args)
+        if getattr(result, 'errors', None):
+            return result
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def submit(self, executor, section, version, state, build, *args):
+        """Build and store the result on executor unless it is already being built; returns the Future
+
+        A build that failed, or reported panel errors, stays pending until ttl
+        has passed, so callers waiting on it stop instead of retrying it on
+        every rerun.
+        """
+        key = (section.name, version, section.key(state), args)
+        now = time.monotonic()
+        with self._lock:
+            for pending_key, (submitted, future) in list(self._pending.items()):
+                if future.done() and now - submitted >= self.ttl:
+                    del self._pending[pending_key]
+            if key in self._pending:
+                return self._pending[key][1]
+            # The build's stages are recorded into the submitting run
+            future = executor.submit(contextvars.copy_context().run, self.get, section, version, state, build, *args)
+            self._pending[key] = (now, future)
+        future.add_done_callback(partial(self._finish, key))
+        return future
+
+    def _finish(self, key, future):
+        if future.exception() is None and not getattr(future.result(), 'errors', None):
+            # Stored by get(); peek() finds it from now on
+            with self._lock:
+                self._pending.pop(key, None)
@@ -0,0 +1,258 @@
+"""Sales snapshot shared by every server process through memory-mapped column files"""
+from contextlib import contextmanager
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from loader import MAX_SNAPSHOT_AGE, SnapshotStore, logger
+from snapshot import append_snapshot, build_snapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows: the writer lock only covers threads of one process
+    fcntl = None
+
+
+POINTER_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+LOCK_FILE = 'writer.lock'
+
+
+def write_snapshot(path, snapshot, base=None):
+    """Write each column of the snapshot to its own .npy file, categoricals as codes
+
+    base records the generation, and its row count, that the snapshot
+    extends with appended rows.
+    """
+    os.makedirs(path)
+    columns = []
+    for i, (name, series) in enumerate(snapshot.items()):
+        column = {'name': name, 'file': f'{i}.npy', 'kind': 'array'}
+        if not isinstance(series.dtype, (pd.CategoricalDtype, np.dtype)) or series.dtype == object:
+            # Strings are stored like categoricals
+            series = series.astype('category')
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            column.update(kind='category', categories=series.cat.categories.tolist(), ordered=series.cat.ordered)
+            values = series.cat.codes.to_numpy()
+        else:
+            values = series.to_numpy()
+        np.save(os.path.join(path, column['file']), values, allow_pickle=False)
+        columns.append(column)
+
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump({'rows': len(snapshot), 'columns': columns, 'base': base}, f)
+
+
+def read_meta(path):
+    """The row count, columns and base of a written snapshot"""
+    with open(os.path.join(path, META_FILE)) as f:
+        return json.load(f)
+
+
+def open_snapshot(path):
+    """Map a written snapshot read-only; its columns share the files' pages instead of copying them"""
+    meta = read_meta(path)
+    # Empty files cannot be mapped
+    mmap_mode = 'r' if meta['rows'] else None
+    columns = {}
+    for column in meta['columns']:
+        values = np.load(os.path.join(path, column['file']), mmap_mode=mmap_mode, allow_pickle=False)
+        if column['kind'] == 'category':
+            values = pd.Categorical.from_codes(values, categories=pd.Index(column['categories']),
+                                               ordered=column['ordered'], validate=False)
+        columns[column['name']] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def _read_pointer(root):
+    """The published generation, when the table was last checked for new rows and last loaded in full, or None"""
+    try:
+        with open(os.path.join(root, POINTER_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_pointer(root, generation, checked_at, built_at):
+    temporary = os.path.join(root, f'{POINTER_FILE}.{os.getpid()}.tmp')
+    with open(temporary, 'w') as f:
+        json.dump({'generation': generation, 'checked_at': checked_at, 'built_at': built_at}, f)
+    # Readers see either the old or the new pointer, never a partial one
+    os.replace(temporary, os.path.join(root, POINTER_FILE))
+
+
+def _publish(root, snapshot, built_at, checked_at=None, base=None):
+    """Write a new generation and swap the pointer to it; checked_at defaults to now"""
+    generation = f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{time.monotonic_ns()}'
+    write_snapshot(os.path.join(root, generation + '.tmp'), snapshot, base)
+    os.rename(os.path.join(root, generation + '.tmp'), os.path.join(root, generation))
+    previous = _read_pointer(root)
+    _write_pointer(root, generation, time.time() if checked_at is None else checked_at, built_at)
+
+    # Keep the previous generation for workers that have read the old pointer
+    # but not mapped it yet; mapped files stay valid after they are removed
+    keep = {generation, previous['generation'] if previous else None}
+    for entry in os.listdir(root):
+        if entry not in keep and os.path.isdir(os.path.join(root, entry)):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+    return generation
+
+
+@contextmanager
+def _writer_lock(root, blocking=True):
+    """Elect the one process that loads and publishes; yields whether the lock was acquired"""
+    with open(os.path.join(root, LOCK_FILE), 'a') as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedSnapshotStore(SnapshotStore):
+    """SnapshotStore whose snapshot lives in memory-mapped files shared by every process on the host
+
+    One process at a time, elected with a file lock, loads the table (or the
+    rows past the high-water mark) and publishes it as a new generation
+    directory of .npy column files, then atomically swaps the CURRENT pointer.
+    Every process maps the current generation read-only, so the rows are held
+    once in the page cache however many workers run and only the publisher
+    queries the database. A published snapshot whose rows were loaded in full
+    more than max_age seconds ago is reloaded in full by the next process that
+    starts or refreshes it. Each process builds the registered aggregates when
+    it maps its first generation. A refresh publishes the previous generation
+    plus appended rows, and processes map it on a background thread, merging
+    in the aggregates of the appended rows only, while get() keeps returning
+    the current snapshot.
+    """
+
+    def __init__(self, fetch_rows, root, refresh_interval=600, cache=None, max_age=MAX_SNAPSHOT_AGE):
+        super().__init__(fetch_rows, refresh_interval, cache, max_age)
+        self.root = root
+        self.generation = None
+        os.makedirs(root, exist_ok=True)
+
+    def get(self):
+        """Return (snapshot, aggregates, version), mapping the first generation before returning"""
+        pointer = _read_pointer(self.root)
+        if self.generation is None:
+            with self._load_lock:
+                if self.generation is None:
+                    self._sync()
+        elif pointer is None or pointer['generation'] != self.generation:
+            self._sync_in_background()
+        elif time.time() - pointer['checked_at'] >= self.refresh_interval:
+            self.refresh(wait=False)
+        return self._state
+
+    def _sync_in_background(self):
+        if self._load_lock.acquire(blocking=False):
+            threading.Thread(target=self._sync_and_release, daemon=True).start()
+
+    def _sync_and_release(self):
+        try:
+            self._sync()
+        except Exception:
+            # Keep serving the mapped generation; the next get() tries again
+            logger.warning("Could not map the published snapshot", exc_info=True)
+        finally:
+            self._load_lock.release()
+
+    def _expired(self, pointer):
+        return self.max_age is not None and time.time() - pointer.get('built_at', 0) >= self.max_age
+
+    def _reload_due(self):
+        # Decided from the pointer under the writer lock, see _append_new_rows
+        return False
+
+    def _sync(self):
+        pointer = _read_pointer(self.root)
+        cached = False
+        if pointer is None or (self.generation is None and self._expired(pointer)):
+            # Blocks while another process performs the initial load or reload
+            with _writer_lock(self.root):
+                pointer = _read_pointer(self.root)
+                if pointer is None or self._expired(pointer):
+                    try:
+                        snapshot, cached = self._initial_snapshot()
+                        # A cached snapshot is published as due for a check against the database
+                        generation = _publish(self.root, snapshot, self.built_at, checked_at=0 if cached else None)
+                    except Exception as e:
+                        self.last_error = e
+                        return
+                    pointer = {'generation': generation}
+                    if not cached:
+                        self._save_in_background(snapshot, self.built_at)
+        if pointer['generation'] != self.generation:
+            self._map(pointer['generation'])
+        if cached:
+            # Reconcile now, once the writer lock the refresh needs is released
+            self.refresh(wait=False)
+
+    def _map(self, generation):
+        path = os.path.join(self.root, generation)
+        snapshot = open_snapshot(path)
+        base = read_meta(path)['base']
+        current, derived, version = self._state
+        if base is not None and base['generation'] == self.generation and derived:
+            # The mapped generation plus appended rows: only those rows are aggregated
+            derived = self._merge_aggregates(derived, snapshot.iloc[base['rows']:].reset_index(drop=True))
+        else:
+            derived = self._build_aggregates(snapshot)
+        # Swapped before the generation changes, so a refresh that sees the new
+        # generation also sees its rows
+        self._swap(snapshot, derived)
+        self.generation = generation
+
+    def _append_new_rows(self):
+        with _writer_lock(self.root, blocking=False) as acquired:
+            if not acquired:
+                return  # another process is refreshing
+            pointer = _read_pointer(self.root)
+            # Another process may have refreshed since; get() maps its generation
+            if pointer is None or pointer['generation'] != self.generation:
+                return
+            if time.time() - pointer['checked_at'] < self.refresh_interval:
+                return
+
+            built_at = pointer.get('built_at', 0)
+            try:
+                if self._expired(pointer):
+                    # Reload the table in full; processes map it with every aggregate rebuilt
+                    reloaded_at = time.time()
+                    snapshot = build_snapshot(self._fetch_rows(None))
+                    _publish(self.root, snapshot, reloaded_at)
+                    built_at = reloaded_at
+                else:
+                    new_rows = build_snapshot(self._fetch_rows(self.high_water_mark))
+                    if new_rows.empty:
+                        _write_pointer(self.root, self.generation, time.time(), built_at)
+                        self.last_error = None
+                        return
+                    # The combined rows are held in memory only until they are written here and to the cache
+                    current = self._state[0]
+                    snapshot = append_snapshot(current, new_rows)
+                    _publish(self.root, snapshot, built_at,
+                             base={'generation': self.generation, 'rows': len(current)})
+            except Exception as e:
+                self.last_error = e
+                logger.warning("Could not refresh the shared snapshot", exc_info=True)
+                # Back off until the next interval, unless the new generation was already published
+                pointer = _read_pointer(self.root)
+                if pointer is not None and pointer['generation'] == self.generation:
+                    _write_pointer(self.root, self.generation, time.time(), built_at)
+                return
+            self._save_in_background(snapshot, built_at)
+            self.last_error = None
@@ -0,0 +1,120 @@
+"""Preprocessing of the raw "data_ETL" rows into a compact, typed snapshot"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from aggregations import MONTH_NAMES, DAY_NAMES
+from perf import instrumented
+
+
+# The city sits between the first two commas, the state and ZIP code after the second
+CITY_PATTERN = r', ([^,]+),'
+STATE_ZIP_PATTERN = r', [^,]+, ([A-Z]{2}) (\d{5})'
+ADDRESS_FIELDS = ['City', 'State', 'ZIP']
+
+
+class AddressParser:
+    """Parses each distinct Purchase Address once and remembers the results across refreshes"""
+
+    def __init__(self, max_entries=2_000_000):
+        self.max_entries = max_entries
+        self._parsed = pd.DataFrame(columns=ADDRESS_FIELDS)
+        self._lock = threading.Lock()
+
+    def _lookup(self, addresses):
+        """City, state and ZIP of each distinct address, running the regexes only on unseen ones"""
+        with self._lock:
+            parsed = self._parsed
+        new = addresses[parsed.index.get_indexer(addresses) < 0]
+        if len(new):
+            text = pd.Series(new, index=new)
+            fields = text.str.extract(STATE_ZIP_PATTERN).set_axis(['State', 'ZIP'], axis=1)
+            fields.insert(0, 'City', text.str.extract(CITY_PATTERN, expand=False))
+            parsed = pd.concat([parsed, fields]) if len(parsed) else fields
+            with self._lock:
+                # Start over rather than grow without bound
+                self._parsed = parsed if len(parsed) <= self.max_entries else fields
+        return parsed.reindex(addresses)
+
+    def parse(self, address):
+        """City, State and ZIP categoricals for a categorical address column, mapped back through its codes"""
+        fields = self._lookup(address.cat.categories)
+        codes = address.cat.codes.to_numpy()
+        columns = {}
+        for field in ADDRESS_FIELDS:
+            field_codes, uniques = pd.factorize(fields[field], sort=True)
+            # Missing addresses have code -1, which picks the appended -1
+            columns[field] = pd.Categorical.from_codes(np.append(field_codes, -1)[codes], uniques)
+        return columns
+
+
+# Shared by every build so refreshes only parse addresses not seen before
+ADDRESSES = AddressParser()
+
+
+def _to_int32(series):
+    """Downcast a numeric series to int32, falling back to float32 when values are missing"""
+    return series.astype('float32') if series.hasnans else series.astype('int32')
+
+
+@instrumented('preprocess')
+def build_snapshot(raw):
+    """Convert types and derive the dashboard columns into a new, read-only snapshot"""
+    if raw.empty:
+        return raw
+
+    order_date = pd.to_datetime(raw['Order Date'])
+    price_each = pd.to_numeric(raw['Price Each'], errors='coerce')
+    quantity = pd.to_numeric(raw['Quantity Ordered'], errors='coerce')
+    address = raw['Purchase Address'].astype('category')
+
+    # Build a new frame; the raw rows are left untouched and the snapshot is
+    # shared by every session, so nothing downstream may mutate it
+    snapshot = raw.assign(**{
+        'Product': raw['Product'].astype('category'),
+        'Quantity Ordered': _to_int32(quantity),
+        'Price Each': price_each.astype('float32'),
+        'Order Date': order_date,
+        'Purchase Address': address,
+        # Totals keep full precision so revenue sums match the source to the cent
+        'Total Sale': price_each.astype('float64') * quantity,
+        # Extract location information once per distinct address
+        **ADDRESSES.parse(address),
+        # Rows without an Order Date get month and hour -1 and no month name or day
+        'Month': order_date.dt.month.fillna(-1).astype('int8'),
+        'Month Name': pd.Categorical(order_date.dt.month_name(), categories=MONTH_NAMES, ordered=True),
+        'Hour': order_date.dt.hour.fillna(-1).astype('int8'),
+        'Day': pd.Categorical(order_date.dt.day_name(), categories=DAY_NAMES, ordered=True),
+    })
+
+    # Sorted by Order Date so date ranges are binary-search slices
+    return snapshot.sort_values('Order Date', kind='stable', ignore_index=True)
+
+
+def concat_categorical(first, second):
+    """Concatenate two frames, merging categories so categorical columns stay categorical
+
+    A column categorical in only one frame, such as the string columns of a
+    shared snapshot, which are stored as categoricals, is made categorical in
+    the other.
+    """
+    first = first.copy(deep=False)
+    second = second.copy(deep=False)
+    categorical = set(first.select_dtypes('category').columns) | set(second.select_dtypes('category').columns)
+    for column in [column for column in first.columns if column in categorical]:
+        first_values = first[column].astype('category')
+        second_values = second[column].astype('category')
+        categories = first_values.cat.categories.union(second_values.cat.categories, sort=False)
+        first[column] = first_values.cat.set_categories(categories)
+        second[column] = second_values.cat.set_categories(categories)
+    return pd.concat([first, second], ignore_index=True)
+
+
+def append_snapshot(snapshot, new_rows):
+    """Return a new snapshot with already preprocessed rows appended"""
+    if new_rows.empty:
+        return snapshot
+    if snapshot.empty:
+        return new_rows
+    return concat_categorical(snapshot, new_rows)
@@ -0,0 +1,116 @@
+"""Synthetic "data_ETL" rows for benchmarks and local development"""
+import numpy as np
+import pandas as pd
+
+
+# Product -> unit price, as in the source sales data
+PRODUCT_PRICES = {
+    'USB-C Charging Cable': 11.95,
+    'Lightning Charging Cable': 14.95,
+    'AAA Batteries (4-pack)': 2.99,
+    'AA Batteries (4-pack)': 3.84,
+    'Wired Headphones': 11.99,
+    'Apple Airpods Headphones': 150.0,
+    'Bose SoundSport Headphones': 99.99,
+    '27in FHD Monitor': 149.99,
+    'iPhone': 700.0,
+    '27in 4K Gaming Monitor': 389.99,
+    '34in Ultrawide Monitor': 379.99,
+    'Google Phone': 600.0,
+    'Flatscreen TV': 300.0,
+    'Macbook Pro Laptop': 1700.0,
+    'ThinkPad Laptop': 999.99,
+    '20in Monitor': 109.99,
+    'Vareebadd Phone': 400.0,
+    'LG Washing Machine': 600.0,
+    'LG Dryer': 600.0,
+}
+# City, state, ZIP code and relative order volume
+CITIES = [
+    ('San Francisco', 'CA', '94016', 24),
+    ('Los Angeles', 'CA', '90001', 16),
+    ('New York City', 'NY', '10001', 13),
+    ('Boston', 'MA', '02215', 11),
+    ('Atlanta', 'GA', '30301', 8),
+    ('Dallas', 'TX', '75001', 8),
+    ('Seattle', 'WA', '98101', 8),
+    ('Portland', 'OR', '97035', 6),
+    ('Austin', 'TX', '73301', 5),
+    ('Portland', 'ME', '04101', 1),
+]
+STREETS = ['Main', 'Park', 'Oak', 'Pine', 'Maple', 'Cedar', 'Elm', 'Washington', 'Lake', 'Hill', 'Church',
+           'Spruce', 'Lincoln', 'Jackson', 'Sunset', 'Highland', 'Center', 'Forest', 'Wilson', 'Meadow']
+STREET_SUFFIXES = ['St', 'Ave', 'Rd', 'Dr', 'Ln']
+# Relative order volume per hour of day, peaking around noon and 7pm
+HOUR_WEIGHTS = np.array([39, 23, 12, 8, 9, 15, 24, 40, 60, 80, 107, 122, 125, 121, 109, 102, 105, 110, 122, 127,
+                         121, 109, 84, 61], dtype='float64')
+# Lines per order: most orders hold a single product
+LINES_PER_ORDER = ([1, 2, 3, 4], [0.91, 0.07, 0.015, 0.005])
+ADDRESS_POOL = 50_000
+
+
+def _addresses(rng, size):
+    """A pool of street addresses spread over CITIES by order volume"""
+    weights = np.array([city[3] for city in CITIES], dtype='float64')
+    city = rng.choice(len(CITIES), size, p=weights / weights.sum())
+    number = rng.integers(1, 1000, size)
+    street = rng.integers(0, len(STREETS), size)
+    suffix = rng.integers(0, len(STREET_SUFFIXES), size)
+    return np.array([
+        f'{n} {STREETS[s]} {STREET_SUFFIXES[x]}, {CITIES[c][0]}, {CITIES[c][1]} {CITIES[c][2]}'
+        for n, s, x, c in zip(number, street, suffix, city)
+    ], dtype=object)
+
+
+def _chunk(rng, n_rows, start, end, first_order_id, addresses):
+    """n_rows order lines dated between start and end, order IDs counting up from first_order_id"""
+    lines, probabilities = LINES_PER_ORDER
+    # Every order has at least one line, so n_rows orders always cover n_rows lines
+    per_order = rng.choice(lines, n_rows, p=probabilities)
+    n_orders = int(np.searchsorted(np.cumsum(per_order), n_rows)) + 1
+    per_order = per_order[:n_orders]
+    per_order[-1] -= per_order.sum() - n_rows
+
+    # Orders are numbered in date order; every line of an order shares its time and address
+    days = np.sort(rng.integers(0, max((end - start).days, 1), n_orders))
+    hours = rng.choice(24, n_orders, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    minutes = rng.integers(0, 60, n_orders)
+    order_dates = (start + pd.to_timedelta(days, unit='D') + pd.to_timedelta(hours, unit='h')
+                   + pd.to_timedelta(minutes, unit='min')).sort_values()
+    order_addresses = addresses[rng.integers(0, len(addresses), n_orders)]
+
+    names = np.array(list(PRODUCT_PRICES), dtype=object)
+    prices = np.array(list(PRODUCT_PRICES.values()))
+    # Cheaper products sell more often
+    popularity = 1 / np.sqrt(prices)
+    product = rng.choice(len(names), n_rows, p=popularity / popularity.sum())
+    quantity = np.where(prices[product] < 20, rng.choice([1, 2, 3], n_rows, p=[0.8, 0.15, 0.05]), 1)
+
+    return pd.DataFrame({
+        'Order ID': np.repeat(np.arange(first_order_id, first_order_id + n_orders), per_order),
+        'Product': names[product],
+        'Quantity Ordered': quantity,
+        'Price Each': prices[product],
+        'Order Date': np.repeat(order_dates.to_numpy(), per_order),
+        'Purchase Address': np.repeat(order_addresses, per_order),
+    })
+
+
+def generate_sales_rows(n_rows, seed=0, start='2019-01-01', end='2020-01-01', chunk_rows=1_000_000):
+    """Yield n_rows "data_ETL"-shaped rows in date-ordered chunks of at most chunk_rows
+
+    Each chunk covers the next slice of the date range, so order IDs and dates
+    increase across chunks and any number of rows can be written without
+    holding them all in memory. The same seed always produces the same rows.
+    """
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    addresses = _addresses(rng, min(ADDRESS_POOL, max(n_rows, 1)))
+    n_chunks = max(-(-n_rows // chunk_rows), 1)
+    bounds = pd.date_range(start, end, periods=n_chunks + 1).normalize()
+
+    order_id = 141234
+    for i, offset in enumerate(range(0, n_rows, chunk_rows)):
+        chunk = _chunk(rng, min(chunk_rows, n_rows - offset), bounds[i], bounds[i + 1], order_id, addresses)
+        order_id = int(chunk['Order ID'].iloc[-1]) + 1
+        yield chunk
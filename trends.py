@@ -0,0 +1,163 @@
+"""Time-bucketed revenue trends at hour, day, week, month and quarter granularity"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from perf import instrumented
+
+
+GRANULARITIES = ['Hour', 'Day', 'Week', 'Month', 'Quarter']
+TREND_MEASURES = ['Total Sale', 'Quantity Ordered', 'Order Lines']
+TREND_COLUMNS = ['Period', *TREND_MEASURES, 'Rolling Average', 'Change', 'Year-over-Year Change']
+# Buckets in the trailing average, and how many buckets back the same period a year earlier is
+ROLLING_WINDOWS = {'Hour': 24, 'Day': 7, 'Week': 4, 'Month': 3, 'Quarter': 4}
+YEAR_LAGS = {'Hour': 364 * 24, 'Day': 364, 'Week': 52, 'Month': 12, 'Quarter': 4}
+HOUR = pd.Timedelta(hours=1)
+
+
+@dataclass
+class HourlySeries:
+    """Revenue, units and order lines per hour from origin, zero in hours without sales
+
+    Every granularity is re-binned from these dense hourly sums, so switching
+    granularity never goes back to the rows. row_count is the number of
+    dated rows summed into them.
+    """
+    origin: pd.Timestamp
+    revenue: np.ndarray
+    units: np.ndarray
+    lines: np.ndarray
+    row_count: int = 0
+
+    @property
+    def empty(self):
+        return len(self.revenue) == 0
+
+    @classmethod
+    def from_buckets(cls, origin, buckets, revenue, units, lines, rows=None):
+        """Sum per-row or per-cell measures by hour bucket, counted from origin; -1 marks a missing date
+
+        rows holds the source rows behind each cell, one each when omitted.
+        """
+        buckets = np.asarray(buckets)
+        valid = buckets >= 0
+        if not valid.any():
+            return cls(None, np.zeros(0), np.zeros(0), np.zeros(0))
+
+        first = int(buckets[valid].min())
+        offsets = buckets[valid] - first
+        length = int(offsets.max()) + 1
+        sums = [np.bincount(offsets, np.nan_to_num(np.asarray(values, dtype='float64')[valid]), length)
+                for values in (revenue, units, lines)]
+        row_count = int(valid.sum()) if rows is None else int(np.asarray(rows)[valid].sum())
+        return cls(origin + first * HOUR, *sums, row_count)
+
+    @classmethod
+    def from_hours(cls, hours, revenue, units, lines, rows=None):
+        """Sum measures by the hour their timestamps fall in"""
+        hours = pd.DatetimeIndex(hours)
+        valid = hours.notna()
+        buckets = np.full(len(hours), -1, dtype='int64')
+        origin = None
+        if valid.any():
+            origin = hours[valid].min().floor('h')
+            buckets[valid] = (hours[valid].floor('h') - origin) // HOUR
+        return cls.from_buckets(origin, buckets, revenue, units, lines, rows)
+
+
+def _hour_buckets(order_dates, origin):
+    buckets = np.full(len(order_dates), -1, dtype='int32')
+    valid = ~np.isnat(order_dates)
+    buckets[valid] = (order_dates[valid] - np.datetime64(origin)) // np.timedelta64(1, 'h')
+    return buckets
+
+
+class TrendIndex:
+    """Hour bucket of every snapshot row, counted from the snapshot's first day"""
+
+    def __init__(self, origin, buckets):
+        self.origin = origin
+        self.buckets = buckets
+
+    @classmethod
+    @instrumented('trend_index', rows_in=lambda args, result: args[1])
+    def from_snapshot(cls, sales_data):
+        """Compute the bucket of every row once per snapshot"""
+        origin = sales_data['Order Date'].min().normalize()
+        return cls(origin, _hour_buckets(sales_data['Order Date'].to_numpy(), origin))
+
+    @staticmethod
+    def merge(index, new_index):
+        """Append the buckets of newly appended rows, re-counted from the existing origin"""
+        shift = (new_index.origin - index.origin) // HOUR
+        new_buckets = np.where(new_index.buckets >= 0, new_index.buckets + shift, -1).astype('int32')
+        return TrendIndex(index.origin, np.concatenate([index.buckets, new_buckets]))
+
+    @instrumented('trend[in-memory]', rows_in=lambda args, result: args[2])
+    def series(self, sales_data, rows):
+        """Hourly sums of the selected snapshot rows, one bincount per measure"""
+        return HourlySeries.from_buckets(
+            self.origin,
+            self.buckets[rows],
+            sales_data['Total Sale'].to_numpy()[rows],
+            sales_data['Quantity Ordered'].to_numpy()[rows],
+            sales_data['Order ID'].notna().to_numpy()[rows],
+        )
+
+
+def _bucket_starts(hours, granularity):
+    """Start of the granularity bucket each hour falls in"""
+    if granularity == 'Hour':
+        return hours
+    days = hours.normalize()
+    if granularity == 'Day':
+        return days
+    if granularity == 'Week':
+        return days - pd.to_timedelta(days.dayofweek, unit='D')
+    return hours.to_period(granularity[0]).start_time
+
+
+def _rolling_mean(values, window):
+    """Trailing mean from running totals; NaN until a full window is available"""
+    totals = np.concatenate([[0.0], np.cumsum(values)])
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        result[window - 1:] = (totals[window:] - totals[:-window]) / window
+    return result
+
+
+def _change(values, lag):
+    """Relative change against the bucket lag positions earlier; NaN where that bucket is zero or missing"""
+    result = np.full(len(values), np.nan)
+    if len(values) > lag:
+        previous = values[:-lag]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result[lag:] = np.where(previous != 0, values[lag:] / previous - 1, np.nan)
+    return result
+
+
+@instrumented('trend_frame', rows_in=lambda args, result: args[0].revenue)
+def trend_frame(series, granularity='Month', window=None):
+    """Re-bin the hourly series to granularity, with a rolling average and period-over-period changes
+
+    Periods are calendar buckets, so months and quarters of different years
+    stay apart. Only the hourly sums are touched, which keeps a switch of
+    granularity to milliseconds whatever the number of rows.
+    """
+    if series.empty:
+        return pd.DataFrame(columns=TREND_COLUMNS)
+
+    hours = pd.date_range(series.origin, periods=len(series.revenue), freq='h')
+    # Hours are consecutive, so the buckets come out in order and none is skipped
+    codes, periods = pd.factorize(_bucket_starts(hours, granularity))
+    trend = pd.DataFrame({'Period': periods})
+    for name, values in zip(TREND_MEASURES, (series.revenue, series.units, series.lines)):
+        trend[name] = np.bincount(codes, values, len(periods))
+    trend[TREND_MEASURES[1:]] = trend[TREND_MEASURES[1:]].round().astype('int64')
+
+    revenue = trend['Total Sale'].to_numpy()
+    trend['Rolling Average'] = _rolling_mean(revenue, window or ROLLING_WINDOWS[granularity])
+    trend['Change'] = _change(revenue, 1)
+    trend['Year-over-Year Change'] = _change(revenue, YEAR_LAGS[granularity])
+    return trend